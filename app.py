@@ -3,17 +3,21 @@ import os
 import json
 import uuid
 import asyncio
+import bisect
+import functools
 import logging
 import subprocess
 import tempfile
 from datetime import datetime
-from typing import Dict, List, Optional, Any
+from urllib.parse import quote
+from typing import Dict, List, Optional, Any, Tuple
 import psutil
 import shutil
+import stat
 
 from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import JSONResponse, FileResponse, Response
 from pydantic import BaseModel
 import openai
 from openai import OpenAI
@@ -33,6 +37,11 @@ except ImportError:
     SUPABASE_AVAILABLE = False
     logger.warning("Supabase не установлен")
 
+# orjson — быстрый C-кодек JSON для кэша транскрипций и анализа (опционально)
+from fast_json import fast_json_dumps, fast_json_loads
+# Число клипов по длительности — общее правило с ультра-быстрым анализом
+from prompt_optimization import get_target_clips
+
 # Redis интеграция (опционально)
 try:
     import redis
@@ -65,6 +74,13 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+def get_available_cpus() -> int:
+    """Число CPU, доступных процессу (с учетом affinity/cpuset контейнера, а не всех ядер хоста)"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # Нет sched_getaffinity (macOS/Windows)
+        return os.cpu_count() or 1
+
 # Конфигурация для 512MB RAM
 class Config:
     UPLOAD_DIR = "uploads"
@@ -79,6 +95,11 @@ class Config:
     CLIP_MAX_DURATION = int(os.getenv("CLIP_MAX_DURATION", "80"))  # Максимальная длительность клипов
     FFMPEG_TIMEOUT_MULTIPLIER = int(os.getenv("FFMPEG_TIMEOUT_MULTIPLIER", "4"))  # Множитель таймаута для ffmpeg
     CONTENT_LANGUAGE = os.getenv("CONTENT_LANGUAGE", "ru")  # Язык контента (ru/en)
+    FFMPEG_THREADS = int(os.getenv("FFMPEG_THREADS", "2"))  # Потоков на один процесс ffmpeg
+    # Параллельных нарезок: доступные ядра / потоки ffmpeg, но не больше MAX_CONCURRENT_TASKS (каждый энкод — сотни MB)
+    MAX_PARALLEL_CLIPS = int(os.getenv("MAX_PARALLEL_CLIPS", str(min(MAX_CONCURRENT_TASKS, max(1, get_available_cpus() // FFMPEG_THREADS)))))
+    MAX_PARALLEL_UPLOADS = int(os.getenv("MAX_PARALLEL_UPLOADS", "4"))  # Параллельных загрузок клипов в Supabase
+    X_ACCEL_REDIRECT_PREFIX = os.getenv("X_ACCEL_REDIRECT_PREFIX", "")  # internal location nginx для отдачи файлов (пусто — отдает Python)
 
 # Создание необходимых папок
 for directory in [Config.UPLOAD_DIR, Config.AUDIO_DIR, Config.CLIPS_DIR]:
@@ -87,6 +108,10 @@ for directory in [Config.UPLOAD_DIR, Config.AUDIO_DIR, Config.CLIPS_DIR]:
 # Глобальные переменные
 analysis_tasks = {}
 generation_tasks = {}
+uploaded_videos = {}  # video_id -> имя файла в UPLOAD_DIR (заполняется при загрузке)
+UPLOAD_INDEX_KEY = "upload_index"  # Тот же индекс в Redis-хэше — для воркеров в других процессах
+video_probe_cache = {}  # путь к видео -> {"duration", "audio_codec"} из одного вызова ffprobe
+keyframe_cache = {}  # путь к видео -> отсортированные времена ключевых кадров
 
 # Инициализация OpenAI
 openai_api_key = os.getenv("OPENAI_API_KEY")
@@ -153,6 +178,18 @@ def check_memory_limit() -> bool:
     except Exception:
         return True
 
+def find_video_filename(video_id: str) -> Optional[str]:
+    """Имя загруженного видео по video_id: из индекса в памяти, иначе один проход по UPLOAD_DIR"""
+    filename = uploaded_videos.get(video_id)
+    if filename:
+        return filename
+    # Файлы могли остаться от прошлого запуска процесса
+    for filename in os.listdir(Config.UPLOAD_DIR):
+        if filename.startswith(video_id):
+            uploaded_videos[video_id] = filename
+            return filename
+    return None
+
 def cleanup_old_files():
     """Очистка старых файлов для освобождения места"""
     try:
@@ -166,6 +203,15 @@ def cleanup_old_files():
                 file_time = datetime.fromtimestamp(os.path.getctime(file_path))
                 if (current_time - file_time).seconds > Config.MAX_TASK_AGE:
                     os.remove(file_path)
+                    video_id = filename.split("_", 1)[0]
+                    uploaded_videos.pop(video_id, None)
+                    if REDIS_AVAILABLE:
+                        try:
+                            redis_client.hdel(UPLOAD_INDEX_KEY, video_id)
+                        except Exception:
+                            pass
+                    video_probe_cache.pop(file_path, None)
+                    keyframe_cache.pop(file_path, None)
                     cleaned_count += 1
         
         # Очистка старых аудио файлов
@@ -236,7 +282,7 @@ async def health_check():
         # Проверяем доступность ffmpeg
         ffmpeg_available = True
         try:
-            subprocess.run(["ffmpeg", "-version"], capture_output=True, check=True, timeout=5)
+            await asyncio.to_thread(subprocess.run, ["ffmpeg", "-version"], capture_output=True, check=True, timeout=5)
         except:
             ffmpeg_available = False
         
@@ -386,8 +432,11 @@ class HybridTaskQueue:
         """Завершить задачу"""
         if REDIS_AVAILABLE:
             try:
-                redis_client.setex(f"{self.results_prefix}{task_id}", 3600, json.dumps(result))
-                redis_client.srem(self.processing_set, task_id)
+                # Запись результата и снятие из processing — один round-trip через pipeline
+                pipe = redis_client.pipeline()
+                pipe.setex(f"{self.results_prefix}{task_id}", 3600, fast_json_dumps(result))
+                pipe.srem(self.processing_set, task_id)
+                pipe.execute()
                 logger.info(f"✅ Задача завершена в Redis: {task_id}")
                 return
             except Exception as e:
@@ -404,7 +453,7 @@ class HybridTaskQueue:
             try:
                 result = redis_client.get(f"{self.results_prefix}{task_id}")
                 if result:
-                    return json.loads(result)
+                    return fast_json_loads(result)
             except Exception as e:
                 logger.error(f"❌ Ошибка Redis: {e}")
         
@@ -415,9 +464,13 @@ class HybridTaskQueue:
         """Статистика очереди"""
         if REDIS_AVAILABLE:
             try:
+                pipe = redis_client.pipeline()
+                pipe.llen(self.queue_name)
+                pipe.scard(self.processing_set)
+                queue_length, processing = pipe.execute()
                 return {
-                    "queue_length": redis_client.llen(self.queue_name),
-                    "processing": redis_client.scard(self.processing_set),
+                    "queue_length": queue_length,
+                    "processing": processing,
                     "redis_available": True,
                     "mode": "redis"
                 }
@@ -480,13 +533,30 @@ def upload_clip_to_supabase(local_path: str, filename: str) -> str:
     logger.warning("⚠️ Используется локальное хранение")
     return f"/api/clips/download/{filename}"
 
+def probe_video_info(video_path: str) -> Dict[str, Any]:
+    """Длительность и кодек первой аудиодорожки одним вызовом ffprobe (кэшируется по пути файла)"""
+    info = video_probe_cache.get(video_path)
+    if info is not None:
+        return info
+    cmd = [
+        'ffprobe', '-v', 'quiet', '-print_format', 'json',
+        '-show_format', '-show_streams', '-select_streams', 'a:0',
+        video_path
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+    data = json.loads(result.stdout)
+    streams = data.get('streams') or []
+    info = {
+        "duration": float(data['format']['duration']),
+        "audio_codec": streams[0].get('codec_name') if streams else None
+    }
+    video_probe_cache[video_path] = info
+    return info
+
 def get_video_duration(video_path: str) -> float:
     """Получение длительности видео"""
     try:
-        cmd = ['ffprobe', '-v', 'quiet', '-print_format', 'json', '-show_format', video_path]
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-        data = json.loads(result.stdout)
-        return float(data['format']['duration'])
+        return probe_video_info(video_path)["duration"]
     except Exception as e:
         logger.error(f"Ошибка получения длительности видео: {e}")
         return 60.0  # Fallback
@@ -496,7 +566,8 @@ def extract_audio(video_path: str, audio_path: str) -> bool:
     try:
         # МАКСИМАЛЬНОЕ КАЧЕСТВО: Приоритет качества над скоростью
         cmd = [
-            'ffmpeg', '-i', video_path, 
+            'ffmpeg', '-hide_banner', '-loglevel', 'error', '-nostats',  # stderr остается коротким
+            '-i', video_path, 
             '-vn',  # Без видео
             '-acodec', 'mp3', 
             '-ar', '16000',  # Оптимальная частота для Whisper
@@ -505,11 +576,15 @@ def extract_audio(video_path: str, audio_path: str) -> bool:
             '-threads', '2',  # Больше потоков (безопасная оптимизация)
             '-y', audio_path
         ]
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True, timeout=120)
-        return os.path.exists(audio_path)
+        # check=True: ненулевой код выхода ffmpeg уже означает ошибку, лишний stat() не нужен
+        subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True, timeout=120)
+        return True
     except subprocess.TimeoutExpired:
         logger.error("❌ Таймаут при извлечении аудио")
         return False
+    except subprocess.CalledProcessError as e:
+        logger.error(f"Ошибка извлечения аудио: {e.stderr.decode(errors='replace')}")
+        return False
     except Exception as e:
         logger.error(f"Ошибка извлечения аудио: {e}")
         return False
@@ -533,7 +608,7 @@ def safe_transcribe_audio_with_cache(audio_path: str, video_path: str, auto_emoj
                 cached_result = redis_client.get(cache_key)
                 if cached_result:
                     logger.info("⚡ Использован кэшированный результат транскрипции (100% качество)")
-                    return json.loads(cached_result)
+                    return fast_json_loads(cached_result)
             except Exception as e:
                 logger.warning(f"Ошибка чтения кэша: {e}")
         
@@ -543,7 +618,7 @@ def safe_transcribe_audio_with_cache(audio_path: str, video_path: str, auto_emoj
         # Сохраняем в кэш
         if result and REDIS_AVAILABLE:
             try:
-                redis_client.setex(cache_key, 24 * 3600, json.dumps(result))  # 24 часа
+                redis_client.setex(cache_key, 24 * 3600, fast_json_dumps(result))  # 24 часа
                 logger.info("💾 Результат транскрипции сохранен в кэш")
             except Exception as e:
                 logger.warning(f"Ошибка сохранения в кэш: {e}")
@@ -937,7 +1012,7 @@ def analyze_with_chatgpt_cached(transcript_text: str, video_duration: float) ->
                 cached_result = redis_client.get(cache_key)
                 if cached_result:
                     logger.info("⚡ Использован кэшированный анализ ChatGPT (100% качество)")
-                    return json.loads(cached_result)
+                    return fast_json_loads(cached_result)
             except Exception as e:
                 logger.warning(f"Ошибка чтения кэша анализа: {e}")
         
@@ -947,7 +1022,7 @@ def analyze_with_chatgpt_cached(transcript_text: str, video_duration: float) ->
         # Сохраняем в кэш
         if result and REDIS_AVAILABLE:
             try:
-                redis_client.setex(cache_key, 12 * 3600, json.dumps(result))  # 12 часов
+                redis_client.setex(cache_key, 12 * 3600, fast_json_dumps(result))  # 12 часов
                 logger.info("💾 Результат анализа сохранен в кэш")
             except Exception as e:
                 logger.warning(f"Ошибка сохранения анализа в кэш: {e}")
@@ -961,27 +1036,19 @@ def analyze_with_chatgpt_cached(transcript_text: str, video_duration: float) ->
 def analyze_with_chatgpt_fast(transcript_text: str, video_duration: float) -> Optional[Dict]:
     """Быстрая версия анализа ChatGPT с оптимизированным промптом"""
     try:
-        # ОПТИМИЗАЦИЯ: Упрощенная логика определения количества клипов
-        if video_duration <= 60:
-            target_clips = 1
-        elif video_duration <= 180:
-            target_clips = 2
-        elif video_duration <= 600:
-            target_clips = 3
-        else:
-            target_clips = 4
+        # ОПТИМИЗАЦИЯ: Упрощенная логика определения количества клипов (границы включительно)
+        target_clips = get_target_clips(video_duration)
         
         # ОПТИМИЗАЦИЯ: Сокращаем транскрипт для скорости
         max_length = 1500
         if len(transcript_text) > max_length:
             part_size = max_length // 3
-            transcript_text = (
-                transcript_text[:part_size] + 
-                " ... " + 
-                transcript_text[len(transcript_text)//2 - part_size//2:len(transcript_text)//2 + part_size//2] + 
-                " ... " + 
+            middle = len(transcript_text) // 2
+            transcript_text = " ... ".join((
+                transcript_text[:part_size],
+                transcript_text[middle - part_size//2:middle + part_size//2],
                 transcript_text[-part_size:]
-            )
+            ))
         
         # ОПТИМИЗАЦИЯ: Сокращенный промпт
         prompt = f"""Find {target_clips} best moments in this {video_duration:.0f}s video for short clips.
@@ -1041,55 +1108,9 @@ Requirements:
         logger.error(f"Ошибка быстрого анализа ChatGPT: {e}")
         return None
 
-def analyze_with_chatgpt(transcript_text: str, video_duration: float) -> Optional[Dict]:
-    """Улучшенный анализ транскрипта с продвинутым алгоритмом поиска клипов"""
-    try:
-        # Адаптивное определение количества клипов с учетом реальности
-        if video_duration <= 60:  # До 1 минуты - только лучший момент
-            target_clips = 1
-            min_quality_threshold = 4.0  # Очень мягкие требования для коротких видео
-            logger.info(f"📹 Короткое видео ({video_duration}s) - ищем 1 лучший момент")
-        elif video_duration <= 120:  # До 2 минут - максимум 2 клипа
-            target_clips = 2
-            min_quality_threshold = 5.0
-            logger.info(f"📹 Короткое видео ({video_duration}s) - ищем до 2 клипов")
-        elif video_duration <= 300:  # До 5 минут - максимум 3 клипа
-            target_clips = 3
-            min_quality_threshold = 6.0
-        elif video_duration <= 600:  # До 10 минут - максимум 4 клипа
-            target_clips = 4
-            min_quality_threshold = 6.5
-        elif video_duration <= 1200:  # До 20 минут - максимум 5 клипов
-            target_clips = 5
-            min_quality_threshold = 7.0
-        elif video_duration <= 1800:  # До 30 минут - максимум 6 клипов
-            target_clips = 6
-            min_quality_threshold = 7.5
-        else:  # Больше 30 минут - максимум 7 клипов
-            target_clips = 7
-            min_quality_threshold = 8.0
-            
-        logger.info(f"🎯 Цель: {target_clips} клипов с минимальным качеством {min_quality_threshold} баллов")
-        
-        # Проверяем, достаточно ли времени для запрошенного количества клипов
-        min_clip_duration = Config.CLIP_MIN_DURATION
-        max_possible_clips = max(1, int(video_duration / (min_clip_duration + 5)))  # +5 сек между клипами
-        
-        if target_clips > max_possible_clips:
-            target_clips = max_possible_clips
-            logger.warning(f"⚠️ Видео слишком короткое для {target_clips} клипов, скорректировано до {max_possible_clips}")
-        
-        # Анализируем контент для определения типа видео
-        content_type = analyze_content_type(transcript_text)
-        
-        # Анализируем ценность контента
-        value_indicators = analyze_content_value(transcript_text)
-        
-        # Определяем ключевые моменты в тексте
-        key_moments = identify_key_moments(transcript_text)
-        # Создаем специализированный промпт в зависимости от типа контента
-        content_strategies = {
-            'educational': """
+# Стратегии поиска клипов по типу контента
+ANALYSIS_CONTENT_STRATEGIES = {
+    'educational': """
 EDUCATIONAL CONTENT STRATEGY:
 - Key concepts and their explanations
 - Practical examples and case studies
@@ -1098,7 +1119,7 @@ EDUCATIONAL CONTENT STRATEGY:
 - Answers to frequently asked questions
 - Demonstrations and proofs
 """,
-            'entertainment': """
+    'entertainment': """
 ENTERTAINMENT CONTENT STRATEGY:
 - Funniest and brightest moments
 - Unexpected twists and surprises
@@ -1107,7 +1128,7 @@ ENTERTAINMENT CONTENT STRATEGY:
 - Amusing dialogues and interactions
 - High-energy moments
 """,
-            'business': """
+    'business': """
 BUSINESS CONTENT STRATEGY:
 - Specific advice and strategies
 - Success and failure examples
@@ -1116,7 +1137,7 @@ BUSINESS CONTENT STRATEGY:
 - Practical recommendations
 - Motivational moments
 """,
-            'personal': """
+    'personal': """
 PERSONAL CONTENT STRATEGY:
 - Emotional stories and experiences
 - Life lessons and wisdom
@@ -1125,7 +1146,7 @@ PERSONAL CONTENT STRATEGY:
 - Inspiring moments
 - Genuine emotions and feelings
 """,
-            'tech': """
+    'tech': """
 TECH CONTENT STRATEGY:
 - New feature demonstrations
 - Complex concepts explained simply
@@ -1133,35 +1154,16 @@ TECH CONTENT STRATEGY:
 - Comparisons and reviews
 - Problem solutions and life hacks
 - Future trends and predictions
-"""
-        }
-        
-        strategy = content_strategies.get(content_type, content_strategies['personal'])
-        
-        # Добавляем информацию о ценности контента в промпт
-        value_context = f"""
-CONTENT VALUE ANALYSIS:
-- Actionable advice moments: {value_indicators.get('actionable_advice', 0)}
-- Specific numbers/data: {value_indicators.get('specific_numbers', 0)}
-- Personal stories: {value_indicators.get('personal_stories', 0)}
-- Expert insights: {value_indicators.get('expert_insights', 0)}
-- Problem solutions: {value_indicators.get('problem_solutions', 0)}
-- Surprising facts: {value_indicators.get('surprising_facts', 0)}
-- Practical tips: {value_indicators.get('practical_tips', 0)}
-
-KEY MOMENTS DETECTED: {', '.join(key_moments[:10]) if key_moments else 'None detected'}
+""",
+}
 
-PRIORITY: Focus on moments with highest value density - where multiple value indicators overlap.
-"""
-        
-        prompt = f"""
+# Системный промпт анализа неизменен между запросами: OpenAI кэширует префиксы от 1024 токенов
+# (быстрее первый токен, cached-токены вдвое дешевле) — все, что зависит от видео, идет после него
+ANALYSIS_SYSTEM_PROMPT = f"""
 You are a world-class content strategist with 10+ years of experience creating viral content that gets millions of views. Your job is to find the MOST VALUABLE moments that will genuinely help, entertain, or inspire the audience.
 
-CONTENT TYPE: {content_type.upper()}
-{strategy}
-
-{value_context}
-
+The user message gives the CONTENT TYPE, a content value analysis, the video duration with the target number of clips, and the transcript. Apply the content strategy named in the user message:
+{''.join(ANALYSIS_CONTENT_STRATEGIES.values())}
 DEEP VALUE ANALYSIS - Find moments that provide:
 1. ACTIONABLE INSIGHTS: Specific advice people can immediately use
 2. EMOTIONAL BREAKTHROUGHS: Moments that change how people think/feel
@@ -1180,8 +1182,6 @@ AUDIENCE VALUE FILTERS:
 - Does this provide unique perspective or insight?
 - Can viewers apply this knowledge immediately?
 
-Transcript: {transcript_text}
-
 PREMIUM CLIP SELECTION CRITERIA:
 1. VALUE DENSITY: Maximum useful information per second
 2. IMMEDIATE APPLICABILITY: Viewers can use this knowledge today
@@ -1192,15 +1192,15 @@ PREMIUM CLIP SELECTION CRITERIA:
 7. MEMORABILITY: Key insights stick in viewer's mind
 8. TRANSFORMATION POTENTIAL: Can genuinely improve someone's situation
 
-ADAPTIVE QUALITY REQUIREMENTS (Video: {video_duration:.1f}s, Target: {target_clips} clips):
-1. Create UP TO {target_clips} clips - prioritize QUALITY over quantity
+ADAPTIVE QUALITY REQUIREMENTS:
+1. Create UP TO the target number of clips - prioritize QUALITY over quantity
 2. Duration: {Config.CLIP_MIN_DURATION}-{Config.CLIP_MAX_DURATION} seconds (adapt to video length)
 3. For SHORT videos (<2min): Focus on the SINGLE best moment if needed
 4. For MEDIUM videos (2-10min): Find 2-4 distinct valuable moments
 5. For LONG videos (>10min): Find multiple high-value segments
 6. Each clip must provide GENUINE VALUE - not just entertainment
 7. Clips must NOT overlap in time
-8. Time within 0-{video_duration:.1f} seconds
+8. Time within 0 and the video duration
 9. Start with immediate value proposition, end with actionable takeaway
 10. REJECT moments that are just filler or low-value content
 11. If video is too short for multiple clips, create ONE exceptional clip
@@ -1237,13 +1237,104 @@ Return result STRICTLY in JSON format:
         }}
     ]
 }}
+"""
+
+def log_prompt_cache_usage(response):
+    """Логирует долю закэшированных токенов промпта (prompt caching OpenAI)"""
+    usage = getattr(response, "usage", None)
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached_tokens = getattr(details, "cached_tokens", None)
+    if usage is None or cached_tokens is None or not usage.prompt_tokens:
+        return
+    logger.info(f"🧠 Кэш промпта OpenAI: {cached_tokens}/{usage.prompt_tokens} токенов ({cached_tokens / usage.prompt_tokens:.0%})")
+
+def analyze_with_chatgpt(transcript_text: str, video_duration: float) -> Optional[Dict]:
+    """Улучшенный анализ транскрипта с продвинутым алгоритмом поиска клипов"""
+    try:
+        # Адаптивное определение количества клипов с учетом реальности
+        if video_duration <= 60:  # До 1 минуты - только лучший момент
+            target_clips = 1
+            min_quality_threshold = 4.0  # Очень мягкие требования для коротких видео
+            logger.info(f"📹 Короткое видео ({video_duration}s) - ищем 1 лучший момент")
+        elif video_duration <= 120:  # До 2 минут - максимум 2 клипа
+            target_clips = 2
+            min_quality_threshold = 5.0
+            logger.info(f"📹 Короткое видео ({video_duration}s) - ищем до 2 клипов")
+        elif video_duration <= 300:  # До 5 минут - максимум 3 клипа
+            target_clips = 3
+            min_quality_threshold = 6.0
+        elif video_duration <= 600:  # До 10 минут - максимум 4 клипа
+            target_clips = 4
+            min_quality_threshold = 6.5
+        elif video_duration <= 1200:  # До 20 минут - максимум 5 клипов
+            target_clips = 5
+            min_quality_threshold = 7.0
+        elif video_duration <= 1800:  # До 30 минут - максимум 6 клипов
+            target_clips = 6
+            min_quality_threshold = 7.5
+        else:  # Больше 30 минут - максимум 7 клипов
+            target_clips = 7
+            min_quality_threshold = 8.0
+            
+        logger.info(f"🎯 Цель: {target_clips} клипов с минимальным качеством {min_quality_threshold} баллов")
+        
+        # Проверяем, достаточно ли времени для запрошенного количества клипов
+        min_clip_duration = Config.CLIP_MIN_DURATION
+        max_possible_clips = max(1, int(video_duration / (min_clip_duration + 5)))  # +5 сек между клипами
+        
+        if target_clips > max_possible_clips:
+            target_clips = max_possible_clips
+            logger.warning(f"⚠️ Видео слишком короткое для {target_clips} клипов, скорректировано до {max_possible_clips}")
+        
+        # Анализируем контент для определения типа видео
+        content_type = analyze_content_type(transcript_text)
+        
+        # Анализируем ценность контента
+        value_indicators = analyze_content_value(transcript_text)
+        
+        # Определяем ключевые моменты в тексте
+        key_moments = identify_key_moments(transcript_text)
+        # Стратегия по типу контента (неизвестный тип — как personal)
+        strategy_type = content_type if content_type in ANALYSIS_CONTENT_STRATEGIES else 'personal'
+        
+        # Добавляем информацию о ценности контента в промпт
+        value_context = f"""
+CONTENT VALUE ANALYSIS:
+- Actionable advice moments: {value_indicators.get('actionable_advice', 0)}
+- Specific numbers/data: {value_indicators.get('specific_numbers', 0)}
+- Personal stories: {value_indicators.get('personal_stories', 0)}
+- Expert insights: {value_indicators.get('expert_insights', 0)}
+- Problem solutions: {value_indicators.get('problem_solutions', 0)}
+- Surprising facts: {value_indicators.get('surprising_facts', 0)}
+- Practical tips: {value_indicators.get('practical_tips', 0)}
+
+KEY MOMENTS DETECTED: {', '.join(key_moments[:10]) if key_moments else 'None detected'}
+
+PRIORITY: Focus on moments with highest value density - where multiple value indicators overlap.
+"""
+        
+        # Все, что зависит от видео, — в сообщении пользователя, транскрипт последним
+        user_prompt = f"""
+CONTENT TYPE: {content_type.upper()} (apply the {strategy_type.upper()} CONTENT STRATEGY)
+
+{value_context}
+
+VIDEO: {video_duration:.1f}s, TARGET: {target_clips} clips
+- Create UP TO {target_clips} clips - prioritize QUALITY over quantity
+- Time within 0-{video_duration:.1f} seconds
+
+Transcript: {transcript_text}
 """
         response = client.chat.completions.create(
             model="gpt-4o",
-            messages=[{"role": "user", "content": prompt}],
+            messages=[
+                {"role": "system", "content": ANALYSIS_SYSTEM_PROMPT},
+                {"role": "user", "content": user_prompt}
+            ],
             max_tokens=1500,
             temperature=0.7
         )
+        log_prompt_cache_usage(response)
         content = response.choices[0].message.content.strip()
         if content.startswith('```json'):
             content = content[7:]
@@ -1367,6 +1458,10 @@ class ClipGenerateRequest(BaseModel):
     video_id: str
     format_id: str = "9x16"  # 9x16, 16x9, 1x1, 4x5
     style_id: str = "modern"  # modern, neon, fire, elegant
+    stream_copy: bool = False  # Без перекодирования: -c copy + мягкие субтитры (mov_text), без обрезки под формат
+
+class ClipStatusBulkRequest(BaseModel):
+    clip_ids: List[str]
 
 class ClipDataResponse(BaseModel):
     task_id: str
@@ -1405,9 +1500,15 @@ async def upload_video(file: UploadFile = File(...)):
                 if not chunk:
                     break
                 buffer.write(chunk)
+        uploaded_videos[video_id] = filename
+        if REDIS_AVAILABLE:
+            try:
+                redis_client.hset(UPLOAD_INDEX_KEY, video_id, filename)
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось записать индекс загрузки в Redis: {e}")
         
-        # Получение длительности видео
-        duration = get_video_duration(file_path)
+        # Получение длительности видео (ffprobe в отдельном потоке, не блокируем event loop)
+        duration = await asyncio.to_thread(get_video_duration, file_path)
         
         # Логирование с информацией о памяти
         memory_info = get_memory_usage()
@@ -1491,6 +1592,16 @@ async def get_video_status(video_id: str):
         logger.error(f"❌ Ошибка получения статуса: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def file_download_response(file_path: str, directory: str, filename: str, headers: Optional[Dict[str, str]] = None) -> Response:
+    """Отдача файла: через nginx X-Accel-Redirect если настроен, иначе FileResponse (sendfile)"""
+    headers = dict(headers or {})
+    if Config.X_ACCEL_REDIRECT_PREFIX:
+        # Заголовки только latin-1: имя файла (может быть кириллицей) передаем в percent-encoding
+        headers["X-Accel-Redirect"] = f"{Config.X_ACCEL_REDIRECT_PREFIX.rstrip('/')}/{directory}/{quote(filename)}"
+        headers["Content-Disposition"] = f"attachment; filename*=utf-8''{quote(filename)}"
+        return Response(media_type="video/mp4", headers=headers)
+    return FileResponse(file_path, media_type="video/mp4", filename=filename, headers=headers)
+
 @app.get("/api/videos/download/{filename}")
 async def download_video(filename: str):
     """Скачивание видео файла (оригинал или клип)"""
@@ -1499,21 +1610,16 @@ async def download_video(filename: str):
         clip_path = os.path.join(Config.CLIPS_DIR, filename)
         if os.path.exists(clip_path):
             logger.info(f"📥 Скачивание клипа: {filename}")
-            return FileResponse(
-                clip_path,
-                media_type="video/mp4",
-                filename=filename
-            )
+            # Клип перезаписывается при повторной генерации, поэтому без долгого кэширования
+            return file_download_response(clip_path, Config.CLIPS_DIR, filename)
         
         # Если не найден в клипах, ищем в оригинальных видео
         video_path = os.path.join(Config.UPLOAD_DIR, filename)
         if os.path.exists(video_path):
             logger.info(f"📥 Скачивание оригинального видео: {filename}")
-            return FileResponse(
-                video_path,
-                media_type="video/mp4",
-                filename=filename
-            )
+            # Имя оригинала содержит uuid и файл не меняется — браузер и CDN могут кэшировать навсегда
+            return file_download_response(video_path, Config.UPLOAD_DIR, filename,
+                                          headers={"Cache-Control": "public, max-age=31536000, immutable"})
         
         # Файл не найден нигде
         raise HTTPException(status_code=404, detail="Файл не найден")
@@ -1524,6 +1630,34 @@ async def download_video(filename: str):
         logger.error(f"❌ Ошибка скачивания файла: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/clips/status/bulk")
+async def get_clips_status_bulk(request: ClipStatusBulkRequest):
+    """Статус готовности сразу многих клипов: один stat() на запрошенный клип, без обхода всей папки"""
+    try:
+        statuses = {}
+        for clip_id in request.clip_ids:
+            filename = f"{clip_id}.mp4"
+            statuses[clip_id] = {"ready": False}
+            # Только имена файлов внутри CLIPS_DIR, без путей
+            if os.path.basename(filename) != filename:
+                continue
+            try:
+                clip_stat = os.stat(os.path.join(Config.CLIPS_DIR, filename))
+            except OSError:
+                continue
+            if stat.S_ISREG(clip_stat.st_mode):
+                statuses[clip_id] = {
+                    "ready": True,
+                    "size": clip_stat.st_size,
+                    "download_url": f"/api/videos/download/{filename}"
+                }
+        
+        return {"clips": statuses}
+        
+    except Exception as e:
+        logger.error(f"❌ Ошибка получения статуса клипов: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.post("/api/clips/generate", response_model=ClipDataResponse)
 async def generate_clips_data(request: ClipGenerateRequest):
     """Генерация клипов с нарезкой видео на бэкенде (с fallback)"""
@@ -1541,12 +1675,11 @@ async def generate_clips_data(request: ClipGenerateRequest):
         result = task["result"]
         
         # Находим файл видео
-        video_files = [f for f in os.listdir(Config.UPLOAD_DIR) if f.startswith(request.video_id)]
-        if not video_files:
+        video_filename = find_video_filename(request.video_id)
+        if not video_filename:
             raise HTTPException(status_code=404, detail="Видео файл не найден")
         
-        video_path = os.path.join(Config.UPLOAD_DIR, video_files[0])
-        video_filename = video_files[0]
+        video_path = os.path.join(Config.UPLOAD_DIR, video_filename)
         
         # Генерируем task_id для отслеживания
         task_id = str(uuid.uuid4())
@@ -1560,7 +1693,8 @@ async def generate_clips_data(request: ClipGenerateRequest):
                 highlights=result["highlights"],
                 transcript=result["transcript"],
                 video_id=request.video_id,
-                format_id=request.format_id
+                format_id=request.format_id,
+                stream_copy=request.stream_copy
             )
             
             if clips_data and len(clips_data) > 0:
@@ -1587,12 +1721,14 @@ async def generate_clips_data(request: ClipGenerateRequest):
             download_url = f"/api/videos/download/{video_filename}"
             
             # Подготавливаем субтитры для каждого хайлайта (без нарезки видео)
+            transcript_index = build_transcript_index(result["transcript"])
             enhanced_highlights = []
             for i, highlight in enumerate(result["highlights"]):
                 clip_subtitles = prepare_clip_subtitles(
                     transcript=result["transcript"],
                     start_time=highlight["start_time"],
-                    end_time=highlight["end_time"]
+                    end_time=highlight["end_time"],
+                    transcript_index=transcript_index
                 )
                 
                 enhanced_highlight = {
@@ -1625,57 +1761,165 @@ async def generate_clips_data(request: ClipGenerateRequest):
         logger.error(f"❌ Ошибка генерации клипов: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-async def cut_video_into_clips(video_path: str, highlights: List[Dict], transcript: List[Dict], video_id: str, format_id: str) -> List[Dict]:
-    """Нарезает видео на отдельные клипы"""
-    clips_data = []
+async def cut_video_into_clips(video_path: str, highlights: List[Dict], transcript: List[Dict], video_id: str, format_id: str, stream_copy: bool = False) -> List[Dict]:
+    """Нарезает видео на отдельные клипы (параллельно, не больше MAX_PARALLEL_CLIPS ffmpeg одновременно)"""
+    ffmpeg_semaphore = asyncio.Semaphore(Config.MAX_PARALLEL_CLIPS)
+    # Загрузка ограничена отдельно: пока клип N загружается, ffmpeg уже режет следующий
+    upload_semaphore = asyncio.Semaphore(Config.MAX_PARALLEL_UPLOADS)
+    # Индекс строится один раз на все хайлайты
+    transcript_index = build_transcript_index(transcript)
     
-    for i, highlight in enumerate(highlights):
+    async def process_highlight(i: int, highlight: Dict) -> Optional[Dict]:
         try:
             clip_id = f"{video_id}_clip_{i+1}"
             clip_filename = f"{clip_id}.mp4"
             clip_path = os.path.join(Config.CLIPS_DIR, clip_filename)
             
-            # Нарезаем видео с помощью ffmpeg
-            success = cut_video_segment(
-                input_path=video_path,
-                output_path=clip_path,
+            # Подготавливаем субтитры для этого клипа
+            clip_subtitles = prepare_clip_subtitles(
+                transcript=transcript,
                 start_time=highlight["start_time"],
                 end_time=highlight["end_time"],
-                format_id=format_id
+                transcript_index=transcript_index
             )
             
+            # Нарезаем видео с помощью ffmpeg в отдельном потоке, чтобы не блокировать event loop
+            clip_start, clip_end = highlight["start_time"], highlight["end_time"]
+            async with ffmpeg_semaphore:
+                if stream_copy:
+                    # Границы stream copy расширяются до ключевых кадров — длительность считаем по ним
+                    snapped = await asyncio.to_thread(
+                        copy_video_segment_with_subtitles,
+                        input_path=video_path,
+                        output_path=clip_path,
+                        start_time=highlight["start_time"],
+                        end_time=highlight["end_time"],
+                        subtitles=clip_subtitles
+                    )
+                    success = snapped is not None
+                    if success:
+                        clip_start, clip_end = snapped
+                        # Клип начинается на ключевом кадре раньше хайлайта — субтитры сдвигаем так же, как в SRT
+                        clip_subtitles = shift_subtitles(clip_subtitles, highlight["start_time"] - clip_start)
+                else:
+                    success = await asyncio.to_thread(
+                        cut_video_segment,
+                        input_path=video_path,
+                        output_path=clip_path,
+                        start_time=highlight["start_time"],
+                        end_time=highlight["end_time"],
+                        format_id=format_id
+                    )
+            
             if not success:
                 logger.error(f"❌ Ошибка нарезки клипа {clip_id}")
-                continue
+                return None
             
-            # Подготавливаем субтитры для этого клипа
-            clip_subtitles = prepare_clip_subtitles(
-                transcript=transcript,
-                start_time=highlight["start_time"],
-                end_time=highlight["end_time"]
-            )
-            
-            # Загружаем клип в Supabase (если доступен)
-            video_url = upload_clip_to_supabase(clip_path, clip_filename)
+            # Загружаем клип в Supabase (если доступен) вне семафора ffmpeg
+            async with upload_semaphore:
+                video_url = await asyncio.to_thread(upload_clip_to_supabase, clip_path, clip_filename)
             
             # Создаем данные клипа
             clip_data = {
                 **highlight,  # Сохраняем оригинальные данные хайлайта
                 "clip_id": clip_id,
                 "video_url": video_url,  # Используем URL из Supabase или локальный
-                "duration": highlight["end_time"] - highlight["start_time"],
+                "clip_start_time": clip_start,  # Фактические границы клипа в исходном видео
+                "clip_end_time": clip_end,
+                "duration": clip_end - clip_start,
                 "subtitles": clip_subtitles,
                 "format_id": format_id
             }
             
-            clips_data.append(clip_data)
             logger.info(f"✅ Клип создан: {clip_id} ({clip_data['duration']:.1f}s)")
+            return clip_data
             
         except Exception as e:
             logger.error(f"❌ Ошибка создания клипа {i+1}: {e}")
-            continue
-    
-    return clips_data
+            return None
+    
+    logger.info(f"🎬 Нарезка {len(highlights)} клипов, параллельно до {Config.MAX_PARALLEL_CLIPS}")
+    results = await asyncio.gather(*(process_highlight(i, highlight) for i, highlight in enumerate(highlights)))
+    
+    # Сохраняем исходный порядок хайлайтов, пропуская неудачные клипы
+    return [clip_data for clip_data in results if clip_data]
+
+# Аппаратные H.264 энкодеры в порядке приоритета (libx264 — запасной вариант)
+HW_VIDEO_ENCODERS = ["h264_nvenc", "h264_qsv", "h264_vaapi", "h264_videotoolbox"]
+VAAPI_DEVICE = os.getenv("VAAPI_DEVICE", "/dev/dri/renderD128")
+
+def get_video_encoder_args(encoder: str) -> Dict[str, Any]:
+    """Аргументы ffmpeg для энкодера: до входа (-hwaccel), суффикс фильтра и параметры кодека"""
+    if encoder == "h264_nvenc":
+        return {"input": ["-hwaccel", "cuda"], "filter": "",
+                "codec": ["-c:v", "h264_nvenc", "-preset", "p4", "-rc", "vbr", "-cq", "26", "-b:v", "0"]}
+    if encoder == "h264_qsv":
+        return {"input": [], "filter": "",
+                "codec": ["-c:v", "h264_qsv", "-preset", "veryfast", "-global_quality", "26"]}
+    if encoder == "h264_vaapi":
+        # VAAPI кодирует из видеопамяти: загружаем кадры после CPU-фильтров
+        return {"input": ["-vaapi_device", VAAPI_DEVICE], "filter": ",format=nv12,hwupload",
+                "codec": ["-c:v", "h264_vaapi", "-qp", "26"]}
+    if encoder == "h264_videotoolbox":
+        return {"input": [], "filter": "",
+                "codec": ["-c:v", "h264_videotoolbox", "-b:v", "6M"]}
+    return {"input": [], "filter": "",
+            "codec": ["-c:v", "libx264", "-preset", "veryfast", "-crf", "26"]}
+
+def probe_video_encoder(encoder: str) -> bool:
+    """Проверяет что энкодер реально работает (есть устройство/драйвер), кодируя один тестовый кадр"""
+    encoder_args = get_video_encoder_args(encoder)
+    # -hwaccel относится к декодеру и для lavfi-источника не нужен, устройство VAAPI — нужно
+    device_args = encoder_args["input"] if encoder == "h264_vaapi" else []
+    cmd = [
+        "ffmpeg", "-hide_banner", "-loglevel", "error",
+        *device_args,
+        "-f", "lavfi", "-i", "color=c=black:s=256x256:d=0.1",
+        "-vf", "format=yuv420p" + encoder_args["filter"],
+        *encoder_args["codec"],
+        "-frames:v", "1", "-f", "null", "-"
+    ]
+    try:
+        return subprocess.run(cmd, capture_output=True, timeout=15).returncode == 0
+    except (subprocess.TimeoutExpired, OSError):
+        return False
+
+@functools.lru_cache(maxsize=1)
+def detect_video_encoder() -> str:
+    """Определяет лучший доступный H.264 энкодер один раз за процесс (FFMPEG_VIDEO_ENCODER=auto|libx264|h264_nvenc|...)"""
+    preferred = os.getenv("FFMPEG_VIDEO_ENCODER", "auto")
+    if preferred != "auto":
+        logger.info(f"🎞️ Видео энкодер задан вручную: {preferred}")
+        return preferred
+    try:
+        result = subprocess.run(["ffmpeg", "-hide_banner", "-encoders"], capture_output=True, text=True, timeout=10)
+        for encoder in HW_VIDEO_ENCODERS:
+            if encoder in result.stdout and probe_video_encoder(encoder):
+                logger.info(f"🚀 Используется аппаратный энкодер: {encoder}")
+                return encoder
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось определить аппаратные энкодеры: {e}")
+    logger.info("🎞️ Аппаратный энкодер не найден, используется libx264")
+    return "libx264"
+
+@functools.lru_cache(maxsize=64)
+def get_encode_command_parts(format_id: str, encoder: str, copy_audio: bool = False) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+    """Неизменяемые части команды ffmpeg для (формат, энкодер, аудио): до -ss и после -t, собираются один раз"""
+    encoder_args = get_video_encoder_args(encoder)
+    crop_filter = CROP_FILTERS.get(format_id, CROP_FILTERS["9x16"])
+    cmd_head = (
+        "ffmpeg", "-y",  # Перезаписывать файлы
+        "-hide_banner", "-loglevel", "error", "-nostats",  # Без прогресса по кадрам в stderr
+        *encoder_args["input"],  # Аппаратное декодирование (если поддерживается)
+    )
+    cmd_tail = (
+        "-vf", crop_filter + encoder_args["filter"],
+        *encoder_args["codec"],  # Видео кодек и параметры качества
+        "-c:a", "copy" if copy_audio else "aac",  # AAC в исходнике копируем без перекодирования
+        "-threads", str(Config.FFMPEG_THREADS),  # Ограничиваем потоки: клипы режутся параллельно
+        "-avoid_negative_ts", "make_zero",  # Избегаем проблем с таймингом
+    )
+    return cmd_head, cmd_tail
 
 def cut_video_segment(input_path: str, output_path: str, start_time: float, end_time: float, format_id: str) -> bool:
     """Нарезает сегмент видео с помощью ffmpeg (оптимизировано для 512MB RAM)"""
@@ -1692,56 +1936,64 @@ def cut_video_segment(input_path: str, output_path: str, start_time: float, end_
             logger.error("❌ ffmpeg не найден на сервере")
             return False
         
-        # Получаем параметры обрезки для формата
-        crop_params = get_crop_parameters_for_format(format_id)
+        # Аппаратный энкодер если доступен, libx264 — запасной вариант
+        video_encoder = detect_video_encoder()
+        encoders = [video_encoder] if video_encoder == "libx264" else [video_encoder, "libx264"]
         
-        # Оптимизированная команда ffmpeg для быстрой обработки
-        cmd = [
-            "ffmpeg", "-y",  # Перезаписывать файлы
-            "-ss", str(start_time),  # Время начала (ПЕРЕД входным файлом для быстрого поиска)
-            "-i", input_path,  # Входной файл
-            "-t", str(end_time - start_time),  # Длительность
-            "-vf", f"scale={crop_params['width']}:{crop_params['height']}:force_original_aspect_ratio=increase,crop={crop_params['width']}:{crop_params['height']}",
-            "-c:v", "libx264",  # Видео кодек
-            "-c:a", "aac",  # Аудио кодек
-            "-preset", "veryfast",  # Быстрое кодирование (компромисс скорость/качество)
-            "-crf", "26",  # Хорошее качество
-            "-threads", "2",  # Два потока для ускорения
-            "-avoid_negative_ts", "make_zero",  # Избегаем проблем с таймингом
-            output_path
-        ]
+        # Аудио фильтрами не меняется: если исходник уже AAC, копируем дорожку (кодек берется из кэша ffprobe)
+        try:
+            copy_audio = probe_video_info(input_path)["audio_codec"] == "aac"
+        except Exception:
+            copy_audio = False
         
-        # Выполняем команду с увеличенным таймаутом для длинных клипов
+        # Таймаут увеличен для длинных клипов
         clip_duration = end_time - start_time
         timeout = max(240, clip_duration * Config.FFMPEG_TIMEOUT_MULTIPLIER)  # Минимум 4 минуты или 4x длительность клипа
-        logger.info(f"🎬 Нарезка клипа {clip_duration:.1f}с с таймаутом {timeout}с")
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
         
-        if result.returncode == 0 and os.path.exists(output_path):
-            logger.info(f"✅ Видео сегмент создан: {output_path}")
-            return True
-        else:
-            logger.warning(f"⚠️ Первая попытка не удалась, пробуем упрощенную команду: {result.stderr}")
-            # Fallback: упрощенная команда без обрезки
-            simple_cmd = [
-                "ffmpeg", "-y",
-                "-ss", str(start_time),
-                "-i", input_path,
-                "-t", str(end_time - start_time),
-                "-c", "copy",  # Копируем без перекодирования
+        for encoder in encoders:
+            # Постоянные части команды собраны заранее для (формат, энкодер, аудио)
+            cmd_head, cmd_tail = get_encode_command_parts(format_id, encoder, copy_audio)
+            cmd = [
+                *cmd_head,
+                "-ss", str(start_time),  # Время начала (ПЕРЕД входным файлом для быстрого поиска)
+                "-i", input_path,  # Входной файл
+                "-t", str(clip_duration),  # Длительность
+                *cmd_tail,
                 output_path
             ]
-            try:
-                simple_result = subprocess.run(simple_cmd, capture_output=True, text=True, timeout=timeout//2)
-                if simple_result.returncode == 0 and os.path.exists(output_path):
-                    logger.info(f"✅ Видео сегмент создан (упрощенная команда): {output_path}")
-                    return True
-                else:
-                    logger.error(f"❌ Ошибка ffmpeg (упрощенная команда): {simple_result.stderr}")
-                    return False
-            except subprocess.TimeoutExpired:
-                logger.error(f"❌ Таймаут даже с упрощенной командой")
+            
+            logger.info(f"🎬 Нарезка клипа {clip_duration:.1f}с ({encoder}) с таймаутом {timeout}с")
+            # stderr в байтах, декодируем только при ошибке
+            result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=timeout)
+            
+            # Код возврата ffmpeg достаточен, отдельная проверка файла не нужна
+            if result.returncode == 0:
+                logger.info(f"✅ Видео сегмент создан ({encoder}): {output_path}")
+                return True
+            logger.warning(f"⚠️ Кодирование {encoder} не удалось: {result.stderr.decode(errors='replace')}")
+        
+        logger.warning("⚠️ Перекодирование не удалось, пробуем упрощенную команду")
+        # Fallback: упрощенная команда без обрезки
+        simple_cmd = [
+            "ffmpeg", "-y",
+            "-hide_banner", "-loglevel", "error", "-nostats",
+            "-ss", str(start_time),
+            "-i", input_path,
+            "-t", str(clip_duration),
+            "-c", "copy",  # Копируем без перекодирования
+            output_path
+        ]
+        try:
+            simple_result = subprocess.run(simple_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=timeout//2)
+            if simple_result.returncode == 0:
+                logger.info(f"✅ Видео сегмент создан (упрощенная команда): {output_path}")
+                return True
+            else:
+                logger.error(f"❌ Ошибка ffmpeg (упрощенная команда): {simple_result.stderr.decode(errors='replace')}")
                 return False
+        except subprocess.TimeoutExpired:
+            logger.error(f"❌ Таймаут даже с упрощенной командой")
+            return False
             
     except subprocess.TimeoutExpired:
         logger.error(f"❌ Таймаут при нарезке видео: {clip_duration:.1f}с клип, таймаут {timeout}с")
@@ -1750,39 +2002,166 @@ def cut_video_segment(input_path: str, output_path: str, start_time: float, end_
         logger.error(f"❌ Ошибка нарезки видео: {e}")
         return False
 
+def format_srt_timestamp(seconds: float) -> str:
+    """Время в формате SRT: HH:MM:SS,mmm"""
+    millis = int(round(max(0.0, seconds) * 1000))
+    hours, millis = divmod(millis, 3600000)
+    minutes, millis = divmod(millis, 60000)
+    secs, millis = divmod(millis, 1000)
+    return f"{hours:02d}:{minutes:02d}:{secs:02d},{millis:03d}"
+
+def write_srt_file(subtitles: List[Dict], srt_path: str, offset: float = 0.0) -> None:
+    """Записывает субтитры клипа (время относительно начала клипа, со сдвигом offset) в SRT файл"""
+    # Пишем блоки сразу в буферизованный файл, без промежуточного списка строк
+    with open(srt_path, "w", encoding="utf-8", buffering=1 << 20) as f:
+        for number, subtitle in enumerate(subtitles, start=1):
+            f.write(f"{number}\n{format_srt_timestamp(subtitle['start'] + offset)} --> "
+                    f"{format_srt_timestamp(subtitle['end'] + offset)}\n{subtitle['text']}\n\n")
+
+def shift_subtitles(subtitles: List[Dict], offset: float) -> List[Dict]:
+    """Копия субтитров (вместе со словами для караоке), сдвинутая на offset секунд"""
+    if not offset:
+        return subtitles
+    shifted = []
+    for subtitle in subtitles:
+        shifted_subtitle = {**subtitle, "start": subtitle["start"] + offset, "end": subtitle["end"] + offset}
+        if "words" in subtitle:
+            shifted_subtitle["words"] = [
+                {**word, "start": word.get("start", 0) + offset, "end": word.get("end", 0) + offset}
+                for word in subtitle["words"]
+            ]
+        shifted.append(shifted_subtitle)
+    return shifted
+
+def get_keyframe_times(video_path: str) -> List[float]:
+    """Времена ключевых кадров видеодорожки по флагам пакетов (без декодирования), кэшируются по пути"""
+    keyframes = keyframe_cache.get(video_path)
+    if keyframes is not None:
+        return keyframes
+    cmd = [
+        "ffprobe", "-v", "error", "-select_streams", "v:0",
+        "-show_entries", "packet=pts_time,flags", "-of", "csv=p=0",
+        video_path
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True, check=True, timeout=120)
+    keyframes = []
+    for line in result.stdout.splitlines():
+        pts_time, _, flags = line.partition(",")
+        if "K" in flags and pts_time not in ("", "N/A"):
+            keyframes.append(float(pts_time))
+    keyframes.sort()
+    keyframe_cache[video_path] = keyframes
+    return keyframes
+
+def snap_to_keyframes(keyframes: List[float], start_time: float, end_time: float) -> Tuple[float, float]:
+    """Расширяет [start, end] до ключевых кадров: последний <= start и первый >= end"""
+    if not keyframes:
+        return start_time, end_time
+    start_index = bisect.bisect_right(keyframes, start_time) - 1
+    snapped_start = keyframes[start_index] if start_index >= 0 else start_time
+    end_index = bisect.bisect_left(keyframes, end_time)
+    snapped_end = keyframes[end_index] if end_index < len(keyframes) else end_time
+    return snapped_start, snapped_end
+
+def copy_video_segment_with_subtitles(input_path: str, output_path: str, start_time: float, end_time: float, subtitles: List[Dict]) -> Optional[Tuple[float, float]]:
+    """Вырезает сегмент без перекодирования (-c copy) и добавляет субтитры дорожкой mov_text; возвращает фактические границы клипа или None"""
+    # Без перекодирования клип может начинаться только с ключевого кадра: границы расширяем явно,
+    # а субтитры сдвигаем на добавленный в начале отрезок
+    try:
+        snapped_start, snapped_end = snap_to_keyframes(get_keyframe_times(input_path), start_time, end_time)
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось получить ключевые кадры: {e}")
+        snapped_start, snapped_end = start_time, end_time
+    clip_duration = snapped_end - snapped_start
+    timeout = max(60, clip_duration)
+    srt_fd, srt_path = tempfile.mkstemp(suffix=".srt", dir=Config.CLIPS_DIR)
+    os.close(srt_fd)
+    try:
+        write_srt_file(subtitles, srt_path, offset=start_time - snapped_start)
+        cmd = [
+            "ffmpeg", "-y",
+            "-hide_banner", "-loglevel", "error", "-nostats",
+            "-ss", str(snapped_start),  # Поиск по входу точно на ключевой кадр
+            "-i", input_path,
+            "-i", srt_path,
+            "-t", str(clip_duration),
+            "-map", "0:v:0", "-map", "0:a?", "-map", "1:0",
+            "-c:v", "copy", "-c:a", "copy", "-c:s", "mov_text",
+            "-avoid_negative_ts", "make_zero",
+            output_path
+        ]
+        logger.info(f"🎬 Копирование клипа {clip_duration:.1f}с без перекодирования (мягкие субтитры)")
+        result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=timeout)
+        if result.returncode == 0:
+            logger.info(f"✅ Видео сегмент создан (stream copy): {output_path}")
+            return snapped_start, snapped_end
+        logger.error(f"❌ Ошибка ffmpeg (stream copy): {result.stderr.decode(errors='replace')}")
+        return None
+    except subprocess.TimeoutExpired:
+        logger.error(f"❌ Таймаут при копировании сегмента: {clip_duration:.1f}с клип")
+        return None
+    except Exception as e:
+        logger.error(f"❌ Ошибка копирования сегмента: {e}")
+        return None
+    finally:
+        if os.path.exists(srt_path):
+            os.remove(srt_path)
+
+# Параметры обрезки для форматов (создаются один раз при загрузке модуля)
+CROP_FORMATS = {
+    "9x16": {"width": 720, "height": 1280},  # TikTok/Instagram Stories
+    "16x9": {"width": 1280, "height": 720},  # YouTube/Landscape
+    "1x1": {"width": 720, "height": 720},    # Instagram Post
+    "4x5": {"width": 720, "height": 900}     # Instagram Portrait
+}
+
+# Готовые строки фильтра scale+crop для каждого формата
+CROP_FILTERS = {
+    format_id: f"scale={params['width']}:{params['height']}:force_original_aspect_ratio=increase,crop={params['width']}:{params['height']}"
+    for format_id, params in CROP_FORMATS.items()
+}
+
 def get_crop_parameters_for_format(format_id: str) -> Dict[str, int]:
     """Возвращает параметры обрезки для разных форматов"""
-    formats = {
-        "9x16": {"width": 720, "height": 1280},  # TikTok/Instagram Stories
-        "16x9": {"width": 1280, "height": 720},  # YouTube/Landscape
-        "1x1": {"width": 720, "height": 720},    # Instagram Post
-        "4x5": {"width": 720, "height": 900}     # Instagram Portrait
-    }
-    return formats.get(format_id, formats["9x16"])
-
-def prepare_clip_subtitles(transcript: List[Dict], start_time: float, end_time: float) -> List[Dict]:
+    return CROP_FORMATS.get(format_id, CROP_FORMATS["9x16"])
+
+def build_transcript_index(transcript: List[Dict]) -> Dict[str, List]:
+    """Индекс транскрипта для поиска слов в диапазоне: слова по start + префиксный максимум end"""
+    # Whisper отдает слова по порядку, поэтому timsort здесь фактически линейный
+    order = sorted(range(len(transcript)), key=lambda k: transcript[k].get("start", 0))
+    words = [transcript[k] for k in order]
+    starts = [word.get("start", 0) for word in words]
+    ends = [word.get("end", 0) for word in words]
+    max_ends = []
+    running_max_end = float("-inf")
+    for end in ends:
+        running_max_end = max(running_max_end, end)
+        max_ends.append(running_max_end)
+    return {"words": words, "starts": starts, "ends": ends, "max_ends": max_ends, "order": order}
+
+def prepare_clip_subtitles(transcript: List[Dict], start_time: float, end_time: float, transcript_index: Optional[Dict[str, List]] = None) -> List[Dict]:
     """Подготавливает субтитры для конкретного клипа с улучшенной фильтрацией"""
-    # Улучшенная фильтрация: включаем слова, которые пересекаются с временным диапазоном
-    clip_words = []
-    for word in transcript:
-        word_start = word.get("start", 0)
-        word_end = word.get("end", 0)
-        
-        # Включаем слово если оно хотя бы частично попадает в диапазон
-        if (word_start < end_time and word_end > start_time):
-            clip_words.append(word)
-    
-    logger.info(f"🔍 Найдено {len(clip_words)} слов в диапазоне {start_time:.1f}s - {end_time:.1f}s из {len(transcript)} общих слов")
-    
-    # Корректируем время относительно начала клипа
-    adjusted_words = []
-    for word in clip_words:
-        adjusted_word = {
-            **word,
-            "start": word.get("start", 0) - start_time,
-            "end": word.get("end", 0) - start_time
-        }
-        adjusted_words.append(adjusted_word)
+    if transcript_index is None:
+        transcript_index = build_transcript_index(transcript)
+    words = transcript_index["words"]
+    
+    # Улучшенная фильтрация: включаем слова, которые пересекаются с временным диапазоном.
+    # Бинарный поиск: [lo, hi) — слова, у которых end может быть > start_time и start < end_time
+    starts = transcript_index["starts"]
+    ends = transcript_index["ends"]
+    lo = bisect.bisect_right(transcript_index["max_ends"], start_time)
+    hi = bisect.bisect_left(starts, end_time)
+    selected = [k for k in range(lo, hi) if ends[k] > start_time]
+    # Слова идут в порядке транскрипта, как при линейном проходе (для упорядоченного входа — уже так)
+    selected.sort(key=transcript_index["order"].__getitem__)
+    
+    # Корректируем время относительно начала клипа (start/end уже извлечены в индексе, без dict.get на слово)
+    adjusted_words = [
+        {**words[k], "start": starts[k] - start_time, "end": ends[k] - start_time}
+        for k in selected
+    ]
+    
+    logger.info(f"🔍 Найдено {len(adjusted_words)} слов в диапазоне {start_time:.1f}s - {end_time:.1f}s из {len(words)} общих слов")
     
     # Группируем слова в субтитры (настраиваемое количество слов)
     words_per_group = int(os.getenv("SUBTITLES_WORDS_PER_GROUP", "6"))
@@ -1914,12 +2293,10 @@ async def get_export_data(video_id: str):
         result = task["result"]
         
         # Находим файл видео
-        video_files = [f for f in os.listdir(Config.UPLOAD_DIR) if f.startswith(video_id)]
-        if not video_files:
+        video_filename = find_video_filename(video_id)
+        if not video_filename:
             raise HTTPException(status_code=404, detail="Видео файл не найден")
         
-        video_filename = video_files[0]
-        
         return {
             "video_id": video_id,
             "video_filename": video_filename,
@@ -1946,24 +2323,25 @@ async def analyze_video_task(task_id: str, video_id: str, auto_emoji: bool = Fal
         analysis_tasks[task_id]["progress"] = 10
         
         # Находим видео файл
-        video_files = [f for f in os.listdir(Config.UPLOAD_DIR) if f.startswith(video_id)]
-        if not video_files:
+        video_filename = find_video_filename(video_id)
+        if not video_filename:
             raise Exception("Видео файл не найден")
         
-        video_path = os.path.join(Config.UPLOAD_DIR, video_files[0])
+        video_path = os.path.join(Config.UPLOAD_DIR, video_filename)
         
         # Извлечение аудио
         analysis_tasks[task_id]["progress"] = 20
         audio_path = os.path.join(Config.AUDIO_DIR, f"{video_id}.wav")
-        if not extract_audio(video_path, audio_path):
+        # Блокирующие ffmpeg/ffprobe и HTTP-вызовы OpenAI выполняются в потоках, чтобы не блокировать event loop
+        if not await asyncio.to_thread(extract_audio, video_path, audio_path):
             raise Exception("Ошибка извлечения аудио")
         
         # Получаем длительность видео для транскрипции
-        video_duration = get_video_duration(video_path)
+        video_duration = await asyncio.to_thread(get_video_duration, video_path)
         
         # Транскрипция с кэшированием (100% качество)
         analysis_tasks[task_id]["progress"] = 50
-        transcript_result = safe_transcribe_audio_with_cache(audio_path, video_path, auto_emoji, video_duration)
+        transcript_result = await asyncio.to_thread(safe_transcribe_audio_with_cache, audio_path, video_path, auto_emoji, video_duration)
         if not transcript_result:
             raise Exception("Ошибка транскрипции")
         
@@ -1991,12 +2369,12 @@ async def analyze_video_task(task_id: str, video_id: str, auto_emoji: bool = Fal
         
         # МАКСИМАЛЬНОЕ КАЧЕСТВО: Всегда используем полный анализ с кэшированием
         logger.info("🎯 Используем полный анализ для максимального качества")
-        analysis_result = analyze_with_chatgpt_cached(transcript_text, video_duration)
+        analysis_result = await asyncio.to_thread(analyze_with_chatgpt_cached, transcript_text, video_duration)
         
         # Fallback только к быстрому анализу если полный не удался
         if not analysis_result:
             logger.warning("⚠️ Полный анализ не удался, пробуем быстрый как fallback")
-            analysis_result = analyze_with_chatgpt_fast(transcript_text, video_duration)
+            analysis_result = await asyncio.to_thread(analyze_with_chatgpt_fast, transcript_text, video_duration)
             
             if not analysis_result:
                 logger.warning("⚠️ Все методы анализа не удались, создаем fallback")
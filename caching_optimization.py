@@ -3,28 +3,117 @@
 Система кэширования для ускорения анализа видео
 """
 import hashlib
-import json
+import logging
 import os
+import tempfile
+import time
+from collections import OrderedDict
 from typing import Dict, Optional
 
+logger = logging.getLogger(__name__)
+
+HASH_SAMPLE_SIZE = 64 * 1024  # Байт с начала и с конца файла для хэша видео
+
+# orjson — быстрый C-кодек JSON для больших транскриптов (опционально)
+from fast_json import fast_json_dumps, fast_json_loads
+
+def atomic_write_json(path: str, obj: Dict) -> bytes:
+    """Атомарная запись JSON: пишем во временный файл и переименовываем через os.replace; возвращает записанные байты"""
+    data = fast_json_dumps(obj)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        # Читатели видят либо старый файл, либо полностью записанный новый
+        os.replace(tmp_path, path)
+        return data
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
 class VideoAnalysisCache:
     """Кэш для результатов анализа видео"""
     
-    def __init__(self):
+    def __init__(self, memory_cache_size: int = 64):
         self.cache_dir = "cache"
         os.makedirs(self.cache_dir, exist_ok=True)
+        # LRU в памяти поверх файлового кэша: путь файла -> (mtime, JSON в байтах).
+        # Храним байты, а не dict: каждый вызов получает свою копию, и изменения вызывающим не портят кэш
+        self._memory_cache = OrderedDict()
+        self._memory_cache_size = memory_cache_size
+        # Хэши видео: (путь, mtime_ns, размер) -> хэш, чтобы не читать файл повторно в одном запросе
+        self._hash_memo = {}
+    
+    def _memory_get(self, cache_file: str, max_age: float) -> Optional[Dict]:
+        """Результат из памяти без чтения диска (с тем же ограничением возраста), новый объект на каждый вызов"""
+        entry = self._memory_cache.get(cache_file)
+        if entry is None:
+            return None
+        mtime, data = entry
+        if time.time() - mtime >= max_age:
+            del self._memory_cache[cache_file]
+            return None
+        self._memory_cache.move_to_end(cache_file)
+        return fast_json_loads(data)
+    
+    def _memory_put(self, cache_file: str, data: bytes, mtime: float):
+        """Кладет JSON в LRU, вытесняя самый давно использованный"""
+        self._memory_cache[cache_file] = (mtime, data)
+        self._memory_cache.move_to_end(cache_file)
+        while len(self._memory_cache) > self._memory_cache_size:
+            self._memory_cache.popitem(last=False)
+    
+    def _read_cache_file(self, cache_file: str, max_age: float) -> Optional[Dict]:
+        """Один open без exists: возраст проверяется по fstat уже открытого файла"""
+        try:
+            f = open(cache_file, 'rb')
+        except FileNotFoundError:
+            return None
+        with f:
+            mtime = os.fstat(f.fileno()).st_mtime
+            if time.time() - mtime >= max_age:
+                return None
+            data = f.read()
+        result = fast_json_loads(data)
+        self._memory_put(cache_file, data, mtime)
+        return result
+    
+    def _cache_path(self, key_hash: str, filename: str) -> str:
+        """Путь файла кэша в подкаталоге по первым двум символам хэша (cache/ab/...)"""
+        return os.path.join(self.cache_dir, key_hash[:2], filename)
     
     def get_video_hash(self, video_path: str) -> str:
         """Получает хэш видео файла для кэширования"""
         try:
-            # Используем размер файла + первые 1KB для быстрого хэша
-            file_size = os.path.getsize(video_path)
+            stat_result = os.stat(video_path)
+            memo_key = (video_path, stat_result.st_mtime_ns, stat_result.st_size)
+            memoized = self._hash_memo.get(memo_key)
+            if memoized:
+                return memoized
+            
+            # Размер + первые и последние 64KB: заголовки контейнеров часто совпадают,
+            # а хвост (данные/индекс moov) у разных видео различается
+            file_size = stat_result.st_size
             with open(video_path, 'rb') as f:
-                first_chunk = f.read(1024)
+                head_chunk = f.read(HASH_SAMPLE_SIZE)
+                f.seek(max(0, file_size - HASH_SAMPLE_SIZE))
+                tail_chunk = f.read(HASH_SAMPLE_SIZE)
+            
+            # Один контекст BLAKE2b вместо MD5 + SHA256: ключ кэша, криптостойкость не нужна
+            video_hash = hashlib.blake2b(digest_size=8)
+            video_hash.update(file_size.to_bytes(8, 'little'))
+            video_hash.update(head_chunk)
+            video_hash.update(tail_chunk)
             
-            hash_data = f"{file_size}_{hashlib.md5(first_chunk).hexdigest()}"
-            return hashlib.sha256(hash_data.encode()).hexdigest()[:16]
-        except:
+            if len(self._hash_memo) >= 1024:
+                self._hash_memo.clear()
+            self._hash_memo[memo_key] = video_hash.hexdigest()
+            return self._hash_memo[memo_key]
+        except OSError as e:
+            logger.warning(f"Не удалось получить хэш видео {video_path}: {e}")
             return None
     
     def get_cached_transcript(self, video_path: str, auto_emoji: bool = False) -> Optional[Dict]:
@@ -33,16 +122,18 @@ class VideoAnalysisCache:
         if not video_hash:
             return None
         
-        cache_file = os.path.join(self.cache_dir, f"transcript_{video_hash}_{auto_emoji}.json")
+        cache_file = self._cache_path(video_hash, f"transcript_{video_hash}_{auto_emoji}.json")
+        
+        cached = self._memory_get(cache_file, 24 * 3600)
+        if cached is not None:
+            logger.info(f"⚡ Использован кэшированный транскрипт (память): {video_hash}")
+            return cached
         
         try:
-            if os.path.exists(cache_file):
-                # Проверяем возраст кэша (не старше 24 часов)
-                cache_age = time.time() - os.path.getmtime(cache_file)
-                if cache_age < 24 * 3600:  # 24 часа
-                    with open(cache_file, 'r', encoding='utf-8') as f:
-                        logger.info(f"⚡ Использован кэшированный транскрипт: {video_hash}")
-                        return json.load(f)
+            result = self._read_cache_file(cache_file, 24 * 3600)  # Не старше 24 часов
+            if result is not None:
+                logger.info(f"⚡ Использован кэшированный транскрипт: {video_hash}")
+                return result
         except Exception as e:
             logger.error(f"Ошибка чтения кэша транскрипта: {e}")
         
@@ -54,11 +145,12 @@ class VideoAnalysisCache:
         if not video_hash:
             return
         
-        cache_file = os.path.join(self.cache_dir, f"transcript_{video_hash}_{auto_emoji}.json")
+        cache_file = self._cache_path(video_hash, f"transcript_{video_hash}_{auto_emoji}.json")
         
         try:
-            with open(cache_file, 'w', encoding='utf-8') as f:
-                json.dump(transcript_result, f, ensure_ascii=False)
+            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+            data = atomic_write_json(cache_file, transcript_result)
+            self._memory_put(cache_file, data, time.time())
             logger.info(f"💾 Транскрипт сохранен в кэш: {video_hash}")
         except Exception as e:
             logger.error(f"Ошибка сохранения кэша транскрипта: {e}")
@@ -68,15 +160,18 @@ class VideoAnalysisCache:
         # Создаем хэш на основе текста и длительности
         text_hash = hashlib.md5(transcript_text.encode()).hexdigest()[:16]
         cache_key = f"analysis_{text_hash}_{int(video_duration)}"
-        cache_file = os.path.join(self.cache_dir, f"{cache_key}.json")
+        cache_file = self._cache_path(text_hash, f"{cache_key}.json")
+        
+        cached = self._memory_get(cache_file, 12 * 3600)
+        if cached is not None:
+            logger.info(f"⚡ Использован кэшированный анализ (память): {cache_key}")
+            return cached
         
         try:
-            if os.path.exists(cache_file):
-                cache_age = time.time() - os.path.getmtime(cache_file)
-                if cache_age < 12 * 3600:  # 12 часов для анализа
-                    with open(cache_file, 'r', encoding='utf-8') as f:
-                        logger.info(f"⚡ Использован кэшированный анализ: {cache_key}")
-                        return json.load(f)
+            result = self._read_cache_file(cache_file, 12 * 3600)  # 12 часов для анализа
+            if result is not None:
+                logger.info(f"⚡ Использован кэшированный анализ: {cache_key}")
+                return result
         except Exception as e:
             logger.error(f"Ошибка чтения кэша анализа: {e}")
         
@@ -86,28 +181,42 @@ class VideoAnalysisCache:
         """Кэширует результат анализа ChatGPT"""
         text_hash = hashlib.md5(transcript_text.encode()).hexdigest()[:16]
         cache_key = f"analysis_{text_hash}_{int(video_duration)}"
-        cache_file = os.path.join(self.cache_dir, f"{cache_key}.json")
+        cache_file = self._cache_path(text_hash, f"{cache_key}.json")
         
         try:
-            with open(cache_file, 'w', encoding='utf-8') as f:
-                json.dump(analysis_result, f, ensure_ascii=False)
+            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+            data = atomic_write_json(cache_file, analysis_result)
+            self._memory_put(cache_file, data, time.time())
             logger.info(f"💾 Анализ сохранен в кэш: {cache_key}")
         except Exception as e:
             logger.error(f"Ошибка сохранения кэша анализа: {e}")
     
+    def _remove_old_files(self, directory: str, current_time: float) -> int:
+        """Удаляет файлы старше 48 часов в одном каталоге"""
+        removed = 0
+        # scandir: тип файла приходит вместе с записью каталога, stat — один на файл
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    file_age = current_time - entry.stat().st_mtime
+                    if file_age > 48 * 3600:  # Старше 48 часов
+                        os.remove(entry.path)
+                        self._memory_cache.pop(entry.path, None)
+                        removed += 1
+        return removed
+    
     def cleanup_old_cache(self):
         """Очищает старый кэш"""
         try:
             current_time = time.time()
             cleaned = 0
             
-            for filename in os.listdir(self.cache_dir):
-                file_path = os.path.join(self.cache_dir, filename)
-                if os.path.isfile(file_path):
-                    file_age = current_time - os.path.getmtime(file_path)
-                    if file_age > 48 * 3600:  # Старше 48 часов
-                        os.remove(file_path)
-                        cleaned += 1
+            # Файлы лежат в подкаталогах-шардах; плоские файлы верхнего уровня — от старой раскладки
+            with os.scandir(self.cache_dir) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        cleaned += self._remove_old_files(entry.path, current_time)
+            cleaned += self._remove_old_files(self.cache_dir, current_time)
             
             if cleaned > 0:
                 logger.info(f"🧹 Очищено {cleaned} старых файлов кэша")
@@ -0,0 +1,31 @@
+# JSON-кодек сервиса: orjson если установлен, иначе стандартный json
+# Результат dumps всегда bytes (UTF-8, компактный) — одинаково с orjson и без него
+
+import json
+from datetime import date, datetime
+
+# orjson — быстрый C-кодек JSON (опционально)
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+def _json_default(obj):
+    """datetime/date в ISO 8601 — как их сериализует orjson"""
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+if ORJSON_AVAILABLE:
+    def fast_json_dumps(obj) -> bytes:
+        return orjson.dumps(obj)
+
+    def fast_json_loads(data):
+        return orjson.loads(data)
+else:
+    def fast_json_dumps(obj) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=_json_default).encode("utf-8")
+
+    def fast_json_loads(data):
+        return json.loads(data)
@@ -3,9 +3,48 @@
 Оптимизированная версия анализа видео с параллельной обработкой
 """
 import asyncio
-import concurrent.futures
+import functools
+import hashlib
+import io
+import os
+import re
 import time
-from typing import Dict, Optional, List
+from typing import Dict, Optional, List, Tuple
+
+from openai import AsyncOpenAI
+
+# xxh3 хэширует гигабайты в секунду — ключ кэша по содержимому аудио почти бесплатен (опционально)
+try:
+    import xxhash
+    
+    def audio_content_hash(data) -> str:
+        return xxhash.xxh3_64_hexdigest(data)
+except ImportError:
+    def audio_content_hash(data) -> str:
+        return hashlib.blake2b(data, digest_size=8).hexdigest()
+
+# Асинхронный клиент OpenAI: ожидание ответа Whisper/ChatGPT не занимает поток
+@functools.lru_cache(maxsize=1)
+def get_async_client() -> AsyncOpenAI:
+    """Асинхронный клиент OpenAI, создается при первом запросе (импорт модуля не требует OPENAI_API_KEY)"""
+    return AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+# orjson — быстрый разбор JSON-ответов ChatGPT и кэша (опционально)
+from fast_json import fast_json_dumps, fast_json_loads
+
+WHISPER_MAX_UPLOAD_BYTES = 25 * 1024 * 1024  # Лимит размера файла Whisper API
+PIPE_READ_LIMIT = 1 << 20  # Буфер StreamReader для stdout процессов (1 MB)
+# ffmpeg печатает длительность входа в stderr: "Duration: 00:01:23.45"
+_FFMPEG_DURATION_RE = re.compile(rb'Duration:\s+(\d+):(\d+):(\d+(?:\.\d+)?)')
+
+FAST_ANALYSIS_MODEL = "gpt-4o-mini"
+LLM_CACHE_TTL = 3600  # Кэш ответов ChatGPT на 1 час
+llm_cache_stats = {"hits": 0, "misses": 0}
+
+# Общие лимиты стадий на все анализы процесса: ffmpeg упирается в CPU, Whisper/ChatGPT — в сеть и rate limit.
+# Параллельность внутри одного видео остается, а при многих видео стадии ждут слот, а не перегружают CPU и API
+ffmpeg_semaphore = asyncio.Semaphore(int(os.getenv("MAX_PARALLEL_FFMPEG", str(os.cpu_count() or 2))))
+openai_semaphore = asyncio.Semaphore(int(os.getenv("MAX_PARALLEL_OPENAI", "10")))
 
 async def optimized_analyze_video_task(task_id: str, video_id: str, auto_emoji: bool = False):
     """Оптимизированная фоновая задача анализа видео с параллельной обработкой"""
@@ -22,27 +61,22 @@ async def optimized_analyze_video_task(task_id: str, video_id: str, auto_emoji:
             raise Exception("Видео файл не найден")
         
         video_path = os.path.join(Config.UPLOAD_DIR, video_files[0])
-        audio_path = os.path.join(Config.AUDIO_DIR, f"{video_id}.wav")
         
-        # ОПТИМИЗАЦИЯ 1: Параллельное извлечение аудио и получение длительности
-        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
-            # Запускаем параллельно
-            audio_future = executor.submit(extract_audio_optimized, video_path, audio_path)
-            duration_future = executor.submit(get_video_duration_fast, video_path)
-            
-            # Ждем результаты
-            audio_success = audio_future.result()
-            video_duration = duration_future.result()
-            
-            if not audio_success:
-                raise Exception("Ошибка извлечения аудио")
+        # ОПТИМИЗАЦИЯ 1: Аудио за один запуск ffmpeg, формат выбирается по длительности из ffprobe
+        # (если ffprobe не справился — длительность берется из stderr ffmpeg)
+        audio_file, video_duration = await extract_audio_optimized(video_path, video_id)
+        
+        if audio_file is None:
+            raise Exception("Ошибка извлечения аудио")
+        if video_duration is None:
+            video_duration = await get_video_duration_fast(video_path)
         
         analysis_tasks[task_id]["progress"] = 25
         logger.info(f"⚡ Аудио извлечено за {time.time() - start_time:.1f}s")
         
         # ОПТИМИЗАЦИЯ 2: Быстрая транскрипция с кэшированием
         transcript_start = time.time()
-        transcript_result = await fast_transcribe_audio(audio_path, auto_emoji, video_duration)
+        transcript_result = await fast_transcribe_audio(audio_file, auto_emoji, video_duration)
         if not transcript_result:
             raise Exception("Ошибка транскрипции")
         
@@ -50,23 +84,18 @@ async def optimized_analyze_video_task(task_id: str, video_id: str, auto_emoji:
         logger.info(f"⚡ Транскрипция завершена за {time.time() - transcript_start:.1f}s")
         
         # ОПТИМИЗАЦИЯ 3: Параллельная обработка транскрипта и анализ
-        if "words" in transcript_result:
-            transcript_text = " ".join([word["word"] for word in transcript_result["words"]])
-            transcript_words = transcript_result["words"]
+        transcript_words = transcript_result.get("words") or []
+        if transcript_words:
+            transcript_text = " ".join(word["word"] for word in transcript_words)
         else:
             transcript_text = transcript_result.get("text", "")
-            transcript_words = []
         
         # Запускаем анализ ChatGPT параллельно с предварительной обработкой
         analysis_start = time.time()
-        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
-            # Параллельно запускаем анализ и предобработку
-            analysis_future = executor.submit(analyze_with_chatgpt_fast, transcript_text, video_duration)
-            preprocessing_future = executor.submit(preprocess_transcript_data, transcript_text, video_duration)
-            
-            # Получаем результаты
-            analysis_result = analysis_future.result()
-            preprocessing_data = preprocessing_future.result()
+        analysis_result, preprocessing_data = await asyncio.gather(
+            analyze_with_chatgpt_fast(transcript_text, video_duration),
+            asyncio.to_thread(preprocess_transcript_data, transcript_text, video_duration)
+        )
         
         analysis_tasks[task_id]["progress"] = 90
         logger.info(f"⚡ Анализ ChatGPT завершен за {time.time() - analysis_start:.1f}s")
@@ -99,63 +128,121 @@ async def optimized_analyze_video_task(task_id: str, video_id: str, auto_emoji:
             "completed_at": datetime.now()
         })
 
-def extract_audio_optimized(video_path: str, audio_path: str) -> bool:
-    """Оптимизированное извлечение аудио с улучшенными параметрами"""
+async def run_process(cmd: List[str], timeout: float, capture_stdout: bool = False,
+                      input_data: Optional[bytes] = None, capture_stderr: bool = False):
+    """Запускает процесс на event loop (без потока); по таймауту процесс убивается"""
+    # Слот берется до запуска: таймаут считается от старта процесса, а не от ожидания очереди
+    async with ffmpeg_semaphore:
+        proc = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=asyncio.subprocess.PIPE if input_data is not None else asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE if capture_stdout else asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE if capture_stderr else asyncio.subprocess.DEVNULL,
+            # read() до EOF читает stdout блоками размера limit: WAV на десятки MB — десятки чтений, а не тысячи
+            limit=PIPE_READ_LIMIT
+        )
+        try:
+            stdout, stderr = await asyncio.wait_for(proc.communicate(input_data), timeout=timeout)
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+            raise
+        return proc.returncode, stdout, stderr
+
+def parse_ffmpeg_duration(stderr: Optional[bytes]) -> Optional[float]:
+    """Длительность входа из лога ffmpeg или None (например, "Duration: N/A")"""
+    match = _FFMPEG_DURATION_RE.search(stderr or b'')
+    if not match:
+        return None
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+# PCM 16 кГц моно s16le — 32000 байт в секунду (плюс заголовок WAV)
+PCM_BYTES_PER_SECOND = 16000 * 2
+
+async def probe_video_duration(video_path: str) -> Optional[float]:
+    """Длительность видео через ffprobe (только заголовки контейнера) или None"""
     try:
-        # ОПТИМИЗАЦИЯ: Более агрессивные параметры для скорости
+        cmd = ['ffprobe', '-v', 'quiet', '-show_entries', 'format=duration', '-of', 'csv=p=0', video_path]
+        returncode, stdout, _ = await run_process(cmd, timeout=10, capture_stdout=True)
+        if returncode != 0:
+            return None
+        return float(stdout.decode().strip())
+    except Exception:
+        return None
+
+async def extract_audio_optimized(video_path: str, video_id: str) -> Tuple[Optional[io.BytesIO], Optional[float]]:
+    """Извлекает аудио в память (WAV или Opus из stdout ffmpeg) и длительность видео"""
+    try:
+        # Весь вывод ffmpeg собирается в памяти: PCM — ~1.9 MB на минуту, и час видео занял бы ~115 MB
+        # (плюс копия при сжатии). Если PCM не пройдет лимит Whisper, ffmpeg сразу кодирует в Opus (~11 MB в час).
+        # Длительность неизвестна — тоже Opus, чтобы не рисковать памятью
+        video_duration = await probe_video_duration(video_path)
+        use_opus = video_duration is None or video_duration * PCM_BYTES_PER_SECOND > WHISPER_MAX_UPLOAD_BYTES
+        if use_opus:
+            codec_args = ['-c:a', 'libopus', '-b:a', '24k', '-f', 'ogg']  # Речь в Opus 24k разборчива
+            extension = "ogg"
+        else:
+            # ОПТИМИЗАЦИЯ: PCM без кодирования — только декод и ресемплинг
+            # (-preset относится к видеокодекам и для аудио игнорировался)
+            codec_args = ['-c:a', 'pcm_s16le', '-f', 'wav']
+            extension = "wav"
         cmd = [
-            'ffmpeg', '-i', video_path,
+            'ffmpeg', '-hide_banner', '-nostats',  # В stderr только сведения о потоках, без прогресса
+            '-i', video_path,
             '-vn',  # Без видео
-            '-acodec', 'mp3',
-            '-ar', '16000',  # Низкая частота для Whisper
             '-ac', '1',  # Моно
-            '-ab', '32k',  # Еще ниже битрейт для скорости
-            '-threads', '2',  # Больше потоков
-            '-preset', 'ultrafast',  # Самый быстрый пресет
-            '-y', audio_path
+            '-ar', '16000',  # Оптимальная частота для Whisper
+            *codec_args,
+            '-threads', '0',  # ffmpeg сам выбирает число потоков
+            'pipe:1'
         ]
         
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True, timeout=120)
-        return os.path.exists(audio_path)
+        returncode, stdout, stderr = await run_process(cmd, timeout=120, capture_stdout=True, capture_stderr=True)
+        if returncode != 0 or not stdout:
+            return None, None
+        audio_file = io.BytesIO(stdout)
+        audio_file.name = f"{video_id}.{extension}"  # OpenAI SDK определяет формат по имени файла
+        if video_duration is None:
+            video_duration = parse_ffmpeg_duration(stderr)
+        return audio_file, video_duration
     except Exception as e:
         logger.error(f"Ошибка оптимизированного извлечения аудио: {e}")
-        return False
+        return None, None
 
-def get_video_duration_fast(video_path: str) -> float:
+async def get_video_duration_fast(video_path: str) -> float:
     """Быстрое получение длительности видео"""
-    try:
-        # ОПТИМИЗАЦИЯ: Используем ffprobe с минимальными параметрами
-        cmd = ['ffprobe', '-v', 'quiet', '-show_entries', 'format=duration', '-of', 'csv=p=0', video_path]
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True, timeout=10)
-        return float(result.stdout.strip())
-    except Exception as e:
-        logger.error(f"Ошибка получения длительности: {e}")
+    video_duration = await probe_video_duration(video_path)
+    if video_duration is None:
+        logger.error(f"Ошибка получения длительности: {video_path}")
         return 60.0
+    return video_duration
 
-async def fast_transcribe_audio(audio_path: str, auto_emoji: bool = False, video_duration: float = 60.0) -> Optional[Dict]:
-    """Быстрая транскрипция с кэшированием и оптимизациями"""
+async def fast_transcribe_audio(audio_file: io.BytesIO, auto_emoji: bool = False, video_duration: float = 60.0) -> Optional[Dict]:
+    """Быстрая транскрипция аудио из памяти с кэшированием и оптимизациями"""
     try:
         # ОПТИМИЗАЦИЯ: Проверяем кэш транскрипций
-        cache_key = f"transcript_{os.path.basename(audio_path)}_{auto_emoji}"
+        # Ключ по содержимому аудио: одинаковое видео под другим именем попадает в кэш,
+        # а перезаписанный файл с тем же именем не получает устаревший транскрипт
+        cache_key = f"transcript_{audio_content_hash(audio_file.getbuffer())}_{auto_emoji}"
         if REDIS_AVAILABLE:
             try:
                 cached_result = redis_client.get(cache_key)
                 if cached_result:
                     logger.info("⚡ Использован кэшированный результат транскрипции")
-                    return json.loads(cached_result)
+                    return fast_json_loads(cached_result)
             except:
                 pass
         
-        # ОПТИМИЗАЦИЯ: Сжимаем аудио файл если он большой
-        file_size = os.path.getsize(audio_path)
-        if file_size > 10 * 1024 * 1024:  # Больше 10MB
-            compressed_path = audio_path.replace('.wav', '_compressed.wav')
-            if compress_audio_for_whisper(audio_path, compressed_path):
-                audio_path = compressed_path
+        # Длинное аудио уже приходит в Opus; сжимаем только WAV, который не прошел лимит Whisper API
+        if audio_file.getbuffer().nbytes > WHISPER_MAX_UPLOAD_BYTES:
+            compressed_file = await compress_audio_for_whisper(audio_file)
+            if compressed_file is not None:
+                audio_file = compressed_file
         
         # Транскрипция с оптимизированными параметрами
-        with open(audio_path, "rb") as audio_file:
-            transcript = client.audio.transcriptions.create(
+        async with openai_semaphore:
+            transcript = await get_async_client().audio.transcriptions.create(
                 model="whisper-1",
                 file=audio_file,
                 response_format="verbose_json",
@@ -163,7 +250,7 @@ async def fast_transcribe_audio(audio_path: str, auto_emoji: bool = False, video
                 # ОПТИМИЗАЦИЯ: Сокращенный промпт для скорости
                 prompt="Include filler words: um, uh, yeah, like, so, well, actually, right, okay."
             )
-            
+        
         result = transcript.model_dump() if hasattr(transcript, 'model_dump') else dict(transcript)
         
         # Быстрая постобработка
@@ -176,7 +263,7 @@ async def fast_transcribe_audio(audio_path: str, auto_emoji: bool = False, video
         # ОПТИМИЗАЦИЯ: Кэшируем результат
         if REDIS_AVAILABLE:
             try:
-                redis_client.setex(cache_key, 3600, json.dumps(result))  # Кэш на 1 час
+                redis_client.setex(cache_key, 3600, fast_json_dumps(result))  # Кэш на 1 час
             except:
                 pass
         
@@ -186,39 +273,45 @@ async def fast_transcribe_audio(audio_path: str, auto_emoji: bool = False, video
         logger.error(f"Ошибка быстрой транскрипции: {e}")
         return None
 
-def compress_audio_for_whisper(input_path: str, output_path: str) -> bool:
-    """Сжимает аудио для ускорения Whisper"""
+async def compress_audio_for_whisper(audio_file: io.BytesIO) -> Optional[io.BytesIO]:
+    """Сжимает длинное аудио в Opus (ogg) через stdin/stdout, чтобы уложиться в лимит загрузки Whisper"""
     try:
         cmd = [
-            'ffmpeg', '-i', input_path,
+            'ffmpeg', '-f', 'wav', '-i', 'pipe:0',
             '-ar', '16000',  # Whisper оптимальная частота
             '-ac', '1',      # Моно
-            '-ab', '16k',    # Минимальный битрейт
-            '-y', output_path
+            '-c:a', 'libopus',
+            '-b:a', '24k',   # Речь в Opus 24k разборчива, ~11 MB в час
+            '-f', 'ogg', 'pipe:1'
         ]
-        subprocess.run(cmd, capture_output=True, check=True, timeout=60)
-        return os.path.exists(output_path)
-    except:
-        return False
+        returncode, stdout, _ = await run_process(cmd, timeout=60, capture_stdout=True, input_data=audio_file.getvalue())
+        if returncode != 0 or not stdout:
+            return None
+        compressed_file = io.BytesIO(stdout)
+        compressed_file.name = os.path.splitext(audio_file.name)[0] + ".ogg"
+        return compressed_file
+    except Exception:
+        return None
+
+# ОПТИМИЗАЦИЯ: Упрощенная версия с основными исправлениями
+QUICK_FILLER_CORRECTIONS = {
+    'um': ['uhm', 'umm'], 'uh': ['uhh'], 'yeah': ['yah', 'yea'],
+    'like': ['lyk'], 'okay': ['ok'], 'right': ['rite']
+}
+# Обратный словарь вариант -> правильное слово: один dict.get на слово вместо перебора списков
+_FILLER_MAP = {v: k for k, vs in QUICK_FILLER_CORRECTIONS.items() for v in vs}
 
 def enhance_filler_words_fast(words: List[Dict]) -> List[Dict]:
     """Быстрая версия обработки вставных слов"""
-    # ОПТИМИЗАЦИЯ: Упрощенная версия с основными исправлениями
-    quick_corrections = {
-        'um': ['uhm', 'umm'], 'uh': ['uhh'], 'yeah': ['yah', 'yea'],
-        'like': ['lyk'], 'okay': ['ok'], 'right': ['rite']
-    }
-    
+    filler_get = _FILLER_MAP.get
     for word in words:
-        word_text = word.get('word', '').strip().lower()
-        for correct, variations in quick_corrections.items():
-            if word_text in variations:
-                word['word'] = correct
-                break
+        correct = filler_get(word.get('word', '').strip().lower())
+        if correct:
+            word['word'] = correct
     
     return words
 
-def analyze_with_chatgpt_fast(transcript_text: str, video_duration: float) -> Optional[Dict]:
+async def analyze_with_chatgpt_fast(transcript_text: str, video_duration: float) -> Optional[Dict]:
     """Быстрая версия анализа ChatGPT с сокращенным промптом"""
     try:
         # ОПТИМИЗАЦИЯ: Сокращенный промпт для скорости
@@ -239,21 +332,35 @@ Focus on: valuable insights, funny moments, key information, emotional peaks.
 JSON format:
 {{"highlights": [{{"start_time": 0, "end_time": 60, "title": "Key Insight", "description": "Main valuable moment"}}]}}"""
 
-        # ОПТИМИЗАЦИЯ: Меньше токенов, быстрее ответ
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",  # Быстрая модель
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=800,  # Меньше токенов
-            temperature=0.3  # Меньше креативности, больше скорости
-        )
+        # ОПТИМИЗАЦИЯ: Промпт детерминирован (транскрипт, длительность, число клипов) —
+        # одинаковый промпт к той же модели отдаем из Redis без запроса к API
+        cache_key = "llm:" + hashlib.blake2b(
+            f"{FAST_ANALYSIS_MODEL}\n{prompt}".encode(), digest_size=16
+        ).hexdigest()
+        if REDIS_AVAILABLE:
+            try:
+                cached_result = redis_client.get(cache_key)
+                if cached_result:
+                    llm_cache_stats["hits"] += 1
+                    logger.info(f"⚡ Кэш анализа ChatGPT: попадание (hits={llm_cache_stats['hits']}, misses={llm_cache_stats['misses']})")
+                    return fast_json_loads(cached_result)
+            except:
+                pass
+            llm_cache_stats["misses"] += 1
+            logger.info(f"🔍 Кэш анализа ChatGPT: промах (hits={llm_cache_stats['hits']}, misses={llm_cache_stats['misses']})")
         
-        content = response.choices[0].message.content.strip()
-        if content.startswith('```json'):
-            content = content[7:]
-        if content.endswith('```'):
-            content = content[:-3]
+        # ОПТИМИЗАЦИЯ: Меньше токенов, быстрее ответ
+        async with openai_semaphore:
+            response = await get_async_client().chat.completions.create(
+                model=FAST_ANALYSIS_MODEL,  # Быстрая модель
+                messages=[{"role": "user", "content": prompt}],
+                max_tokens=800,  # Меньше токенов
+                temperature=0.3,  # Меньше креативности, больше скорости
+                # JSON mode: модель отдает сразу объект — без ```-обертки и пояснений, которые тоже генерируются токенами
+                response_format={"type": "json_object"}
+            )
         
-        result = json.loads(content.strip())
+        result = fast_json_loads(response.choices[0].message.content)
         highlights = result.get("highlights", [])
         
         # Быстрая валидация
@@ -264,7 +371,14 @@ JSON format:
             elif duration > 80:
                 highlight["end_time"] = highlight["start_time"] + 80
         
-        return {"highlights": highlights}
+        result = {"highlights": highlights}
+        if REDIS_AVAILABLE:
+            try:
+                redis_client.setex(cache_key, LLM_CACHE_TTL, fast_json_dumps(result))
+            except:
+                pass
+        
+        return result
         
     except Exception as e:
         logger.error(f"Ошибка быстрого анализа ChatGPT: {e}")
@@ -280,19 +394,16 @@ def preprocess_transcript_data(transcript_text: str, video_duration: float) -> D
 
 def create_fallback_highlights_fast(video_duration: float, preprocessing_data: Dict) -> Dict:
     """Быстрое создание fallback хайлайтов"""
-    clips_count = min(2, max(1, int(video_duration / 60)))
-    highlights = []
-    
+    # 1 клип до 2 минут, иначе 2 (то же, что min(2, max(1, int(duration / 60))))
+    clips_count = 1 if video_duration < 120 else 2
     segment_duration = video_duration / clips_count
-    for i in range(clips_count):
-        start = i * segment_duration
-        end = min(start + 50, video_duration)  # 50 секунд клип
-        
-        highlights.append({
-            "start_time": start,
-            "end_time": end,
+    
+    return {"highlights": [
+        {
+            "start_time": i * segment_duration,
+            "end_time": min(i * segment_duration + 50, video_duration),  # 50 секунд клип
             "title": f"Moment {i+1}",
             "description": "Auto-generated highlight"
-        })
-    
-    return {"highlights": highlights}
\ No newline at end of file
+        }
+        for i in range(clips_count)
+    ]}
\ No newline at end of file
@@ -2,9 +2,20 @@
 """
 Тест производительности оптимизаций
 """
+import asyncio
+import os
 import time
 import json
 
+BENCH_ITERATIONS = 10000  # Итераций микробенчмарка: медиана перекрывает разрешение таймера и шум ОС
+DECODE_ITERATIONS = 1000  # Разбор JSON транскрипта — сотни µs, столько замеров достаточно
+
+def latency_percentiles(samples_ns):
+    """p50/p95/p99 в микросекундах по замерам perf_counter_ns"""
+    ordered = sorted(samples_ns)
+    last = len(ordered) - 1
+    return tuple(ordered[round(last * q)] / 1000 for q in (0.50, 0.95, 0.99))
+
 def test_prompt_optimization():
     """Тест оптимизации промпта"""
     
@@ -13,26 +24,28 @@ def test_prompt_optimization():
     
     print("=== Тест оптимизации промпта ===")
     
-    # Тест 1: Сокращение транскрипта
-    start_time = time.time()
-    
+    # Тест 1: Сокращение транскрипта (один вызов — микросекунды, ниже разрешения таймера: меряем серию)
     max_length = 1500
-    if len(long_transcript) > max_length:
-        part_size = max_length // 3
-        optimized_transcript = (
-            long_transcript[:part_size] + 
-            " ... " + 
-            long_transcript[len(long_transcript)//2 - part_size//2:len(long_transcript)//2 + part_size//2] + 
-            " ... " + 
-            long_transcript[-part_size:]
-        )
-    
-    optimization_time = time.time() - start_time
+    samples = []
+    for _ in range(BENCH_ITERATIONS):
+        start_ns = time.perf_counter_ns()
+        optimized_transcript = long_transcript
+        if len(long_transcript) > max_length:
+            part_size = max_length // 3
+            middle = len(long_transcript) // 2
+            optimized_transcript = " ... ".join((
+                long_transcript[:part_size],
+                long_transcript[middle - part_size//2:middle + part_size//2],
+                long_transcript[-part_size:]
+            ))
+        samples.append(time.perf_counter_ns() - start_ns)
+    
+    p50, p95, p99 = latency_percentiles(samples)
     
     print(f"📊 Исходный транскрипт: {len(long_transcript)} символов")
     print(f"📊 Оптимизированный: {len(optimized_transcript)} символов")
     print(f"⚡ Сокращение на: {((len(long_transcript) - len(optimized_transcript)) / len(long_transcript) * 100):.1f}%")
-    print(f"⏱️ Время оптимизации: {optimization_time*1000:.1f}ms")
+    print(f"⏱️ Время оптимизации ({BENCH_ITERATIONS} итераций): p50 {p50:.1f}µs, p95 {p95:.1f}µs, p99 {p99:.1f}µs")
     
     return True
 
@@ -87,26 +100,57 @@ def test_ffmpeg_optimization():
     
     return True
 
+async def measure_redis_get_latency(payload: bytes):
+    """Замеры GET из реального Redis (REDIS_URL); None если redis не установлен или недоступен"""
+    try:
+        import redis.asyncio as aioredis
+    except ImportError:
+        return None
+    
+    client = aioredis.from_url(os.getenv("REDIS_URL", "redis://localhost:6379/0"), socket_connect_timeout=0.5)
+    try:
+        await client.ping()
+    except Exception:
+        await client.aclose()
+        return None
+    
+    key = "perf_test:transcript"
+    samples = []
+    try:
+        await client.set(key, payload, ex=60)
+        for _ in range(BENCH_ITERATIONS):
+            start_ns = time.perf_counter_ns()
+            await client.get(key)
+            samples.append(time.perf_counter_ns() - start_ns)
+        await client.delete(key)
+    finally:
+        await client.aclose()
+    return samples
+
 def test_cache_simulation():
-    """Симуляция работы кэша"""
+    """Задержка попадания в кэш: чтение из Redis и разбор JSON транскрипта"""
     
     print("\n=== Тест кэширования ===")
     
-    # Симуляция без кэша
-    start_time = time.time()
-    time.sleep(0.1)  # Имитация обработки
-    no_cache_time = time.time() - start_time
-    
-    # Симуляция с кэшем
-    start_time = time.time()
-    time.sleep(0.001)  # Имитация чтения из кэша
-    cache_time = time.time() - start_time
-    
-    speedup = no_cache_time / cache_time
-    
-    print(f"📊 Без кэша: {no_cache_time*1000:.1f}ms")
-    print(f"📊 С кэшем: {cache_time*1000:.1f}ms")
-    print(f"⚡ Ускорение: {speedup:.0f}x")
+    # Типичный кэшированный транскрипт: 500 слов с таймкодами
+    transcript = {"words": [{"word": f"word{i}", "start": i * 0.4, "end": i * 0.4 + 0.3} for i in range(500)]}
+    payload = json.dumps(transcript).encode()
+    
+    # Разбор JSON — часть каждого попадания в кэш, меряется всегда
+    samples = []
+    for _ in range(DECODE_ITERATIONS):
+        start_ns = time.perf_counter_ns()
+        json.loads(payload)
+        samples.append(time.perf_counter_ns() - start_ns)
+    p50, p95, p99 = latency_percentiles(samples)
+    print(f"📊 json.loads транскрипта ({len(payload) // 1024} KB): p50 {p50:.1f}µs, p95 {p95:.1f}µs, p99 {p99:.1f}µs")
+    
+    redis_samples = asyncio.run(measure_redis_get_latency(payload))
+    if redis_samples is None:
+        print("⚠️ Redis недоступен — замер GET пропущен")
+    else:
+        p50, p95, p99 = latency_percentiles(redis_samples)
+        print(f"📊 Redis GET ({BENCH_ITERATIONS} запросов): p50 {p50:.1f}µs, p95 {p95:.1f}µs, p99 {p99:.1f}µs")
     
     return True
 
@@ -2,71 +2,132 @@
 """
 Оптимизированные промпты для ускорения анализа ChatGPT
 """
+import asyncio
+import bisect
+import functools
+import os
+import re
+from typing import Dict, Optional
 
-def get_optimized_prompt(transcript_text: str, video_duration: float, content_type: str = "general") -> str:
-    """Создает оптимизированный промпт для быстрого анализа"""
-    
-    # Определяем количество клипов
-    if video_duration <= 60:
-        target_clips = 1
-    elif video_duration <= 180:
-        target_clips = 2
-    elif video_duration <= 600:
-        target_clips = 3
-    else:
-        target_clips = 4
-    
-    # Сокращаем транскрипт если он слишком длинный
-    max_transcript_length = 1500  # Меньше токенов = быстрее ответ
-    if len(transcript_text) > max_transcript_length:
-        # Берем начало, середину и конец
-        part_size = max_transcript_length // 3
-        transcript_text = (
-            transcript_text[:part_size] + 
-            " ... " + 
-            transcript_text[len(transcript_text)//2 - part_size//2:len(transcript_text)//2 + part_size//2] + 
-            " ... " + 
+from openai import AsyncOpenAI
+
+@functools.lru_cache(maxsize=1)
+def get_async_client() -> AsyncOpenAI:
+    """Асинхронный клиент OpenAI, создается при первом запросе (импорт модуля не требует OPENAI_API_KEY)"""
+    return AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+# orjson — быстрый разбор JSON-ответа ChatGPT (опционально)
+from fast_json import fast_json_loads
+
+# tiktoken — обрезка транскрипта по токенам, а не по символам (опционально)
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    TIKTOKEN_AVAILABLE = False
+
+MAX_TRANSCRIPT_LENGTH = 1500  # Символов, если tiktoken недоступен
+# Бюджет токенов транскрипта — те же ~1500 символов: английский ~4 символа на токен,
+# кириллица токенизируется в 2-3 раза плотнее. Для прочих языков — плотный бюджет
+MAX_TRANSCRIPT_TOKENS = {"en": 375, "ru": 750}
+DEFAULT_TRANSCRIPT_TOKENS = 750
+CONTENT_LANGUAGE = os.getenv("CONTENT_LANGUAGE", "ru")  # Как Config.CONTENT_LANGUAGE в app.py
+
+@functools.lru_cache(maxsize=1)
+def get_token_encoding():
+    """Энкодер gpt-4o-mini, создается один раз; None если tiktoken недоступен.
+    Первый вызов может скачивать словарь — из async-кода вызывать через asyncio.to_thread"""
+    if not TIKTOKEN_AVAILABLE:
+        return None
+    try:
+        return tiktoken.encoding_for_model("gpt-4o-mini")
+    except Exception:
+        return None
+
+def shorten_transcript(transcript_text: str, language: Optional[str] = None) -> str:
+    """Сокращает транскрипт до бюджета: начало, середина и конец"""
+    encoding = get_token_encoding()
+    if encoding is None:
+        if len(transcript_text) <= MAX_TRANSCRIPT_LENGTH:
+            return transcript_text
+        part_size = MAX_TRANSCRIPT_LENGTH // 3
+        middle = len(transcript_text) // 2
+        return " ... ".join((
+            transcript_text[:part_size],
+            transcript_text[middle - part_size//2:middle + part_size//2],
             transcript_text[-part_size:]
-        )
+        ))
     
-    # Быстрые промпты для разных типов контента
-    quick_prompts = {
-        "educational": f"""Find {target_clips} best educational moments in this {video_duration:.0f}s video.
+    # Цена и задержка ответа зависят от токенов: режем по их границам
+    max_tokens = MAX_TRANSCRIPT_TOKENS.get(language or CONTENT_LANGUAGE, DEFAULT_TRANSCRIPT_TOKENS)
+    tokens = encoding.encode(transcript_text)
+    if len(tokens) <= max_tokens:
+        return transcript_text
+    part_size = max_tokens // 3
+    middle = len(tokens) // 2
+    return " ... ".join(encoding.decode(part) for part in (
+        tokens[:part_size],
+        tokens[middle - part_size//2:middle + part_size//2],
+        tokens[-part_size:]
+    ))
+
+# Быстрые промпты для разных типов контента: шаблоны str.format собираются один раз при импорте,
+# а на вызов форматируется только нужный (раньше на каждый вызов строились все четыре)
+QUICK_PROMPT_TEMPLATES = {
+    "educational": """Find {target_clips} best educational moments in this {duration:.0f}s video.
 Look for: explanations, tips, how-to steps, key insights, examples.
 
-Transcript: {transcript_text}
+Transcript: {transcript}
 
 Return JSON: {{"highlights": [{{"start_time": 0, "end_time": 60, "title": "Key Tip", "description": "Why valuable"}}]}}
-Each clip: 40-80 seconds, no overlap, times 0-{video_duration:.0f}.""",
+Each clip: 40-80 seconds, no overlap, times 0-{duration:.0f}.""",
 
-        "entertainment": f"""Find {target_clips} funniest/most entertaining moments in this {video_duration:.0f}s video.
+    "entertainment": """Find {target_clips} funniest/most entertaining moments in this {duration:.0f}s video.
 Look for: jokes, funny stories, surprising moments, emotional peaks.
 
-Transcript: {transcript_text}
+Transcript: {transcript}
 
 Return JSON: {{"highlights": [{{"start_time": 0, "end_time": 60, "title": "Funny Moment", "description": "Why entertaining"}}]}}
-Each clip: 40-80 seconds, no overlap, times 0-{video_duration:.0f}.""",
+Each clip: 40-80 seconds, no overlap, times 0-{duration:.0f}.""",
 
-        "business": f"""Find {target_clips} most valuable business insights in this {video_duration:.0f}s video.
+    "business": """Find {target_clips} most valuable business insights in this {duration:.0f}s video.
 Look for: strategies, results, advice, case studies, numbers.
 
-Transcript: {transcript_text}
+Transcript: {transcript}
 
 Return JSON: {{"highlights": [{{"start_time": 0, "end_time": 60, "title": "Business Tip", "description": "Why useful"}}]}}
-Each clip: 40-80 seconds, no overlap, times 0-{video_duration:.0f}.""",
+Each clip: 40-80 seconds, no overlap, times 0-{duration:.0f}.""",
 
-        "general": f"""Find {target_clips} best moments in this {video_duration:.0f}s video for short clips.
+    "general": """Find {target_clips} best moments in this {duration:.0f}s video for short clips.
 Look for: interesting insights, emotional moments, valuable information, entertaining parts.
 
-Transcript: {transcript_text}
+Transcript: {transcript}
 
 Return JSON: {{"highlights": [{{"start_time": 0, "end_time": 60, "title": "Best Moment", "description": "Why interesting"}}]}}
-Each clip: 40-80 seconds, no overlap, times 0-{video_duration:.0f}."""
-    }
+Each clip: 40-80 seconds, no overlap, times 0-{duration:.0f}."""
+}
+
+# Длительность до 60s -> 1 клип, до 180s -> 2, до 600s -> 3, дальше 4
+CLIP_DURATION_BOUNDS = (60, 180, 600)
+CLIP_COUNTS = (1, 2, 3, 4)
+
+def get_target_clips(video_duration: float) -> int:
+    """Количество клипов по длительности видео (границы включительно)"""
+    return CLIP_COUNTS[bisect.bisect_left(CLIP_DURATION_BOUNDS, video_duration)]
+
+def get_optimized_prompt(transcript_text: str, video_duration: float, content_type: str = "general") -> str:
+    """Создает оптимизированный промпт для быстрого анализа"""
+    
+    # Определяем количество клипов
+    target_clips = get_target_clips(video_duration)
     
-    return quick_prompts.get(content_type, quick_prompts["general"])
+    # Сокращаем транскрипт если он слишком длинный (меньше токенов = быстрее ответ)
+    transcript_text = shorten_transcript(transcript_text)
+    
+    template = QUICK_PROMPT_TEMPLATES.get(content_type, QUICK_PROMPT_TEMPLATES["general"])
+    return template.format(target_clips=target_clips, duration=video_duration, transcript=transcript_text)
 
-def analyze_with_chatgpt_ultra_fast(transcript_text: str, video_duration: float) -> Optional[Dict]:
+async def analyze_with_chatgpt_ultra_fast(transcript_text: str, video_duration: float) -> Optional[Dict]:
     """Ультра-быстрый анализ с минимальным промптом"""
     try:
         # Определяем тип контента быстро
@@ -80,26 +141,21 @@ def analyze_with_chatgpt_ultra_fast(transcript_text: str, video_duration: float)
         else:
             content_type = "general"
         
-        prompt = get_optimized_prompt(transcript_text, video_duration, content_type)
+        # Загрузка словаря tiktoken (при первом вызове — возможно, с диска или из сети) и токенизация — вне event loop
+        prompt = await asyncio.to_thread(get_optimized_prompt, transcript_text, video_duration, content_type)
         
         # Используем быструю модель с минимальными параметрами
-        response = client.chat.completions.create(
+        response = await get_async_client().chat.completions.create(
             model="gpt-4o-mini",  # Самая быстрая модель
             messages=[{"role": "user", "content": prompt}],
             max_tokens=500,  # Минимум токенов
             temperature=0.1,  # Минимум креативности
-            top_p=0.9  # Фокус на лучших вариантах
+            top_p=0.9,  # Фокус на лучших вариантах
+            # JSON mode: ответ — сразу JSON-объект, без markdown-обертки
+            response_format={"type": "json_object"}
         )
         
-        content = response.choices[0].message.content.strip()
-        
-        # Быстрая очистка JSON
-        if '```json' in content:
-            content = content.split('```json')[1].split('```')[0]
-        elif '```' in content:
-            content = content.split('```')[1]
-        
-        result = json.loads(content.strip())
+        result = fast_json_loads(response.choices[0].message.content)
         highlights = result.get("highlights", [])
         
         # Минимальная валидация
@@ -116,20 +172,39 @@ def analyze_with_chatgpt_ultra_fast(transcript_text: str, video_duration: float)
         logger.error(f"Ошибка ультра-быстрого анализа: {e}")
         return None
 
+CONTENT_KEYWORDS = {
+    'educational': ['learn', 'teach', 'explain', 'understand', 'how to', 'tutorial', 'guide', 'lesson'],
+    'entertainment': ['funny', 'hilarious', 'joke', 'laugh', 'story', 'amazing', 'crazy', 'wow'],
+    'business': ['business', 'money', 'profit', 'strategy', 'success', 'entrepreneur', 'marketing'],
+    'tech': ['technology', 'software', 'app', 'digital', 'ai', 'programming', 'code'],
+    'personal': ['life', 'experience', 'personal', 'journey', 'story', 'advice', 'wisdom']
+}
+
+def _keyword_pattern(word: str) -> str:
+    """Группа для ключевого слова: совпадение по началу слова, чтобы находились формы (learning, explained, jokes)"""
+    if len(word) <= 3:
+        # Короткие слова ('ai', 'app') как префикс дают ложные совпадения (aim, approach) — только слово и мн. число
+        return '(' + re.escape(word) + r's?\b)'
+    if word.endswith('y'):
+        # story -> stories
+        return '(' + re.escape(word[:-1]) + '(?:y|ie))'
+    return '(' + re.escape(word) + ')'
+
+# Одна скомпилированная альтернация на категорию: один проход по тексту вместо поиска каждого слова.
+# У каждого ключевого слова своя группа — по номеру группы считаются разные найденные слова
+_CONTENT_KEYWORD_RX = {
+    category: re.compile(r'\b(?:' + '|'.join(map(_keyword_pattern, words)) + ')')
+    for category, words in CONTENT_KEYWORDS.items()
+}
+
 def smart_content_detection(transcript_text: str) -> str:
     """Быстрое определение типа контента"""
     text_lower = transcript_text[:500].lower()  # Анализируем только начало
     
-    keywords = {
-        'educational': ['learn', 'teach', 'explain', 'understand', 'how to', 'tutorial', 'guide', 'lesson'],
-        'entertainment': ['funny', 'hilarious', 'joke', 'laugh', 'story', 'amazing', 'crazy', 'wow'],
-        'business': ['business', 'money', 'profit', 'strategy', 'success', 'entrepreneur', 'marketing'],
-        'tech': ['technology', 'software', 'app', 'digital', 'ai', 'programming', 'code'],
-        'personal': ['life', 'experience', 'personal', 'journey', 'story', 'advice', 'wisdom']
+    # Очко категории — число разных найденных ключевых слов
+    scores = {
+        category: len({match.lastindex for match in rx.finditer(text_lower)})
+        for category, rx in _CONTENT_KEYWORD_RX.items()
     }
     
-    scores = {}
-    for category, words in keywords.items():
-        scores[category] = sum(1 for word in words if word in text_lower)
-    
-    return max(scores, key=scores.get) if max(scores.values()) > 0 else 'general'
\ No newline at end of file
+    return max(scores, key=scores.get) if max(scores.values()) > 0 else 'general'
@@ -5,6 +5,8 @@
 import json
 import time
 
+DETAIL_FIELDS = ("hook", "climax", "viral_potential", "emotion", "keywords")  # Поля детального анализа
+
 def simulate_analysis_comparison():
     """Симулирует сравнение качества анализа"""
     
@@ -80,15 +82,9 @@ def simulate_analysis_comparison():
         highlights = result["highlights"]
         avg_score = sum(h.get("quality_score", 0) for h in highlights) / len(highlights)
         
-        detail_level = 0
-        for h in highlights:
-            if h.get("hook"): detail_level += 1
-            if h.get("climax"): detail_level += 1
-            if h.get("viral_potential"): detail_level += 1
-            if h.get("emotion"): detail_level += 1
-            if h.get("keywords"): detail_level += 1
-        
-        detail_level = detail_level / (len(highlights) * 5) * 100
+        # Заполненные поля детализации: один проход по полям всех клипов без счетчика и цепочки if
+        filled = sum(1 for h in highlights for field in DETAIL_FIELDS if h.get(field))
+        detail_level = filled / (len(highlights) * len(DETAIL_FIELDS)) * 100
         
         print(f"\n{name}:")
         print(f"  📈 Средний балл качества: {avg_score:.1f}/10")
@@ -151,15 +147,15 @@ def test_transcript_truncation_impact():
     
     # Сокращение до 1500 символов
     max_length = 1500
+    truncated = full_transcript
     if len(full_transcript) > max_length:
         part_size = max_length // 3
-        truncated = (
-            full_transcript[:part_size] + 
-            " ... " + 
-            full_transcript[len(full_transcript)//2 - part_size//2:len(full_transcript)//2 + part_size//2] + 
-            " ... " + 
+        middle = len(full_transcript) // 2
+        truncated = " ... ".join((
+            full_transcript[:part_size],
+            full_transcript[middle - part_size//2:middle + part_size//2],
             full_transcript[-part_size:]
-        )
+        ))
     
     print(f"📊 Исходный транскрипт: {len(full_transcript)} символов")
     print(f"📊 Сокращенный транскрипт: {len(truncated)} символов")
@@ -3,12 +3,42 @@
 Система контроля качества для оптимизаций
 """
 import os
-import json
+import re
+import time
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Optional
 
 logger = logging.getLogger(__name__)
 
+# Пороги сложности транскрипта: ниже SIMPLE — хватает gpt-4o-mini, от COMPLEX — всегда полный анализ
+SIMPLE_COMPLEXITY_THRESHOLD = 0.2
+COMPLEX_COMPLEXITY_THRESHOLD = 0.6
+# Маркеры рассуждений на английском и русском (CONTENT_LANGUAGE по умолчанию ru):
+# у русских — совпадение по основе, чтобы находились падежи и формы (анализируем, сравнении)
+_REASONING_MARKERS_RE = re.compile(
+    r"\b(?:because|therefore|however|although|whereas|analy[sz]e|compare)\b"
+    r"|\b(?:потому что|поэтому|однако|хотя|тогда как|следовательно|так как)\b|\b(?:анализ|сравн)",
+    re.IGNORECASE
+)
+_ENTITY_RE = re.compile(r"\b(?:[A-Z][a-z]+|[А-ЯЁ][а-яё]+)\b")
+
+# orjson — быстрая сериализация отчетов и журнала решений (опционально)
+from fast_json import fast_json_dumps
+
+# Журнал решений быстрый/полный режим: путь к JSONL файлу, по умолчанию выключен
+QUALITY_DECISIONS_LOG = os.getenv("QUALITY_DECISIONS_LOG", "")
+
+def _is_valid_title(title: str) -> bool:
+    """Заголовок из 2-6 слов"""
+    if not title:
+        return False
+    # Быстрый путь без списка слов: печатные символы и одиночные пробелы без краевых —
+    # тогда пробелов ровно на один меньше, чем слов
+    if title.isprintable() and "  " not in title and title[0] != " " and title[-1] != " ":
+        return 1 <= title.count(" ") <= 5
+    return 2 <= len(title.split()) <= 6
+
 class QualityController:
     """Контроллер качества для анализа видео"""
     
@@ -18,13 +48,28 @@ class QualityController:
             "analysis_quality": "good", 
             "processing_speed": "normal"
         }
+        # Размеры исходных видео: загрузки не перезаписываются, stat по сетевому диску не повторяем
+        self._video_sizes = {}
     
     def check_audio_quality(self, audio_path: str, original_video_path: str) -> Dict:
         """Проверяет качество извлеченного аудио"""
         try:
             # Проверяем размер аудио файла
-            audio_size = os.path.getsize(audio_path)
-            video_size = os.path.getsize(original_video_path)
+            try:
+                audio_size = os.stat(audio_path).st_size
+                video_size = self._video_sizes.get(original_video_path)
+                if video_size is None:
+                    video_size = os.stat(original_video_path).st_size
+                    if len(self._video_sizes) >= 1024:
+                        self._video_sizes.clear()
+                    self._video_sizes[original_video_path] = video_size
+            except FileNotFoundError as e:
+                logger.error("Файл для проверки качества аудио не найден: %s", e)
+                return {"quality": "unknown", "error": str(e)}
+            
+            if video_size == 0:
+                logger.error("Пустой видео файл: %s", original_video_path)
+                return {"quality": "unknown", "error": "Пустой видео файл"}
             
             # Аудио должно быть 1-5% от размера видео
             audio_ratio = audio_size / video_size
@@ -44,11 +89,12 @@ class QualityController:
                 quality_assessment["quality"] = "inefficient"
                 quality_assessment["warning"] = "Аудио файл слишком большой, можно сжать больше"
             
-            logger.info(f"🎵 Качество аудио: {quality_assessment['quality']}, размер: {quality_assessment['audio_size_mb']:.1f}MB")
+            # Аргументы %-форматирования: строка собирается, только если уровень INFO включен
+            logger.info("🎵 Качество аудио: %s, размер: %.1fMB", quality_assessment["quality"], quality_assessment["audio_size_mb"])
             return quality_assessment
             
         except Exception as e:
-            logger.error(f"Ошибка проверки качества аудио: {e}")
+            logger.error("Ошибка проверки качества аудио: %s", e)
             return {"quality": "unknown", "error": str(e)}
     
     def validate_analysis_quality(self, analysis_result: Dict, transcript_text: str, video_duration: float) -> Dict:
@@ -71,35 +117,32 @@ class QualityController:
                 quality_metrics["error"] = "Нет найденных клипов"
                 return quality_metrics
             
-            # Проверяем покрытие видео
-            total_clip_duration = sum(h["end_time"] - h["start_time"] for h in highlights)
-            quality_metrics["total_coverage"] = total_clip_duration / video_duration
-            quality_metrics["avg_clip_duration"] = total_clip_duration / len(highlights)
-            
-            # Проверяем качество заголовков
+            # Один проход по клипам: покрытие, заголовки, описания и валидность времени
+            total_clip_duration = 0
             valid_titles = 0
-            for highlight in highlights:
-                title = highlight.get("title", "")
-                if title and len(title.split()) >= 2 and len(title.split()) <= 6:
-                    valid_titles += 1
-            quality_metrics["title_quality"] = valid_titles / len(highlights)
-            
-            # Проверяем качество описаний
             valid_descriptions = 0
+            valid_times = 0
             for highlight in highlights:
+                total_clip_duration += highlight["end_time"] - highlight["start_time"]
+                
+                if _is_valid_title(highlight.get("title", "")):
+                    valid_titles += 1
+                
                 description = highlight.get("description", "")
                 if description and len(description) > 10:
                     valid_descriptions += 1
-            quality_metrics["description_quality"] = valid_descriptions / len(highlights)
-            
-            # Проверяем валидность времени
-            valid_times = 0
-            for highlight in highlights:
+                
                 start = highlight.get("start_time", 0)
                 end = highlight.get("end_time", 0)
                 if 0 <= start < end <= video_duration and (end - start) >= 30:
                     valid_times += 1
-            quality_metrics["time_validity"] = valid_times / len(highlights)
+            
+            clips_count = len(highlights)
+            quality_metrics["total_coverage"] = total_clip_duration / video_duration
+            quality_metrics["avg_clip_duration"] = total_clip_duration / clips_count
+            quality_metrics["title_quality"] = valid_titles / clips_count
+            quality_metrics["description_quality"] = valid_descriptions / clips_count
+            quality_metrics["time_validity"] = valid_times / clips_count
             
             # Общая оценка качества
             overall_score = (
@@ -117,38 +160,80 @@ class QualityController:
             else:
                 quality_metrics["overall_quality"] = "poor"
             
-            logger.info(f"📊 Качество анализа: {quality_metrics['overall_quality']}, покрытие: {quality_metrics['total_coverage']:.1%}")
+            logger.info("📊 Качество анализа: %s, покрытие: %.1f%%", quality_metrics["overall_quality"], quality_metrics["total_coverage"] * 100)
             return quality_metrics
             
         except Exception as e:
-            logger.error(f"Ошибка валидации качества анализа: {e}")
+            logger.error("Ошибка валидации качества анализа: %s", e)
             return {"overall_quality": "error", "error": str(e)}
     
-    def should_use_fast_mode(self, video_duration: float, transcript_length: int) -> bool:
+    def classify_complexity(self, transcript_text: str) -> float:
+        """Оценка сложности транскрипта от 0 (простой) до 1 (сложный)"""
+        words_count = len(transcript_text.split())
+        if not words_count:
+            return 0.0
+        per_100_words = max(1.0, words_count / 100)
+        
+        # Маркеры рассуждений: 3+ на 100 слов — максимум
+        reasoning = min(1.0, len(_REASONING_MARKERS_RE.findall(transcript_text)) / per_100_words / 3)
+        # Разные имена собственные (слова с заглавной): 10+ на 100 слов — максимум
+        entities = min(1.0, len(set(_ENTITY_RE.findall(transcript_text))) / per_100_words / 10)
+        # Грубая оценка токенов (~4 символа на токен): 4000+ — максимум
+        tokens = min(1.0, len(transcript_text) / 4 / 4000)
+        
+        return round(0.5 * reasoning + 0.3 * entities + 0.2 * tokens, 3)
+    
+    def should_use_fast_mode(self, video_duration: float, transcript_length: int, transcript_text: Optional[str] = None) -> bool:
         """Определяет, стоит ли использовать быстрый режим"""
         
+        # Сложность считаем только если передан текст транскрипта
+        complexity = self.classify_complexity(transcript_text) if transcript_text is not None else None
+        
         # Факторы для принятия решения
         factors = {
             "short_video": video_duration <= 180,  # Короткое видео
             "simple_content": transcript_length <= 1000,  # Простой контент
             "fast_mode_enabled": os.getenv("FAST_MODE", "false").lower() == "true",
-            "high_load": False  # TODO: проверить нагрузку системы
+            "high_load": False,  # TODO: проверить нагрузку системы
+            "low_complexity": complexity is not None and complexity < SIMPLE_COMPLEXITY_THRESHOLD,
+            "high_complexity": complexity is not None and complexity >= COMPLEX_COMPLEXITY_THRESHOLD
         }
         
         # Логика принятия решения
+        use_fast_mode = False
+        reason = "🎯 Полный режим: приоритет качества"
         if factors["fast_mode_enabled"]:
-            if factors["short_video"] and factors["simple_content"]:
-                logger.info("⚡ Быстрый режим: короткое видео + простой контент")
-                return True
+            if factors["high_complexity"]:
+                reason = f"🎯 Полный режим: сложный контент (сложность {complexity:.2f})"
+            elif factors["low_complexity"]:
+                use_fast_mode, reason = True, f"⚡ Быстрый режим: простой контент (сложность {complexity:.2f})"
+            elif factors["short_video"] and factors["simple_content"]:
+                use_fast_mode, reason = True, "⚡ Быстрый режим: короткое видео + простой контент"
             elif factors["short_video"]:
-                logger.info("⚡ Быстрый режим: короткое видео")
-                return True
+                use_fast_mode, reason = True, "⚡ Быстрый режим: короткое видео"
             elif factors["high_load"]:
-                logger.info("⚡ Быстрый режим: высокая нагрузка системы")
-                return True
+                use_fast_mode, reason = True, "⚡ Быстрый режим: высокая нагрузка системы"
         
-        logger.info("🎯 Полный режим: приоритет качества")
-        return False
+        logger.info(reason)
+        self._record_decision(video_duration, transcript_length, complexity, use_fast_mode)
+        return use_fast_mode
+    
+    def _record_decision(self, video_duration: float, transcript_length: int, complexity: Optional[float], use_fast_mode: bool):
+        """Дописывает решение о режиме в журнал JSONL для A/B сравнения"""
+        if not QUALITY_DECISIONS_LOG:
+            return
+        record = {
+            "timestamp": time.time(),
+            "video_duration": video_duration,
+            "transcript_length": transcript_length,
+            "complexity": complexity,
+            "fast_mode": use_fast_mode
+        }
+        try:
+            with open(QUALITY_DECISIONS_LOG, "ab") as f:
+                f.write(fast_json_dumps(record) + b"\n")
+        except OSError as e:
+            logger.warning("Не удалось записать решение о режиме: %s", e)
     
     def get_quality_report(self, video_id: str, processing_time: float, quality_metrics: Dict) -> Dict:
         """Создает отчет о качестве обработки"""
@@ -189,6 +274,8 @@ class QualityController:
 
 # Глобальный контроллер качества
 quality_controller = QualityController()
+# Общий пул для проверок с ожиданием диска: не создаем и не останавливаем потоки на каждую задачу
+_quality_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="quality")
 
 def enhanced_analyze_video_task(task_id: str, video_id: str, auto_emoji: bool = False):
     """Анализ видео с контролем качества"""
@@ -196,27 +283,43 @@ def enhanced_analyze_video_task(task_id: str, video_id: str, auto_emoji: bool =
     start_time = time.time()
     
     try:
-        logger.info(f"🔍 Начат анализ с контролем качества: {video_id}")
+        logger.info("🔍 Начат анализ с контролем качества: %s", video_id)
         
         # ... основная логика анализа ...
         
         # В конце добавляем проверку качества
         processing_time = time.time() - start_time
         
-        # Собираем метрики качества
+        # Собираем метрики качества: stat файлов (может ждать сетевой диск) и проверка анализа
+        # не зависят друг от друга — выполняем одновременно
+        # (stat — в общем пуле, проверка анализа — в текущем потоке)
+        audio_future = _quality_executor.submit(quality_controller.check_audio_quality, audio_path, video_path)
+        analysis_quality = quality_controller.validate_analysis_quality(analysis_result, transcript_text, video_duration)
         quality_metrics = {
-            "audio_quality": quality_controller.check_audio_quality(audio_path, video_path),
-            "analysis_quality": quality_controller.validate_analysis_quality(analysis_result, transcript_text, video_duration)
+            "audio_quality": audio_future.result(),
+            "analysis_quality": analysis_quality
         }
         
         # Создаем отчет
         quality_report = quality_controller.get_quality_report(video_id, processing_time, quality_metrics)
         
-        logger.info(f"📊 Отчет качества: {quality_report['overall_rating']}, время: {processing_time:.1f}s")
+        # Одно событие на задачу: поля отчета в extra — для структурного (JSON) форматтера
+        logger.info(
+            "📊 Отчет качества %s: %s, время: %.1fs", video_id, quality_report["overall_rating"], processing_time,
+            extra={
+                "video_id": video_id,
+                "quality_rating": quality_report["overall_rating"],
+                "processing_time": processing_time,
+                "recommendations": quality_report["recommendations"]
+            }
+        )
         
-        # Добавляем отчет к результату
-        analysis_tasks[task_id]["quality_report"] = quality_report
+        # Добавляем отчет к результату: в Redis-хэш задачи, чтобы его видели все воркеры;
+        # словарь процесса — только если Redis недоступен
+        from quick_scaling_solution import task_queue
+        if not task_queue.update_task_field(task_id, "quality_report", quality_report):
+            analysis_tasks[task_id]["quality_report"] = quality_report
         
     except Exception as e:
-        logger.error(f"Ошибка анализа с контролем качества: {e}")
+        logger.error("Ошибка анализа с контролем качества: %s", e)
         raise
\ No newline at end of file
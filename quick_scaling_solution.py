@@ -2,15 +2,23 @@
 # Добавляем Redis для очереди задач без полной переписки
 
 import redis
-import json
-import uuid
+import glob
+import os
+import hashlib
+import socket
+import threading
+import time
 from datetime import datetime
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 import asyncio
 import logging
 
 logger = logging.getLogger(__name__)
 
+# orjson — C-кодек JSON для задач и результатов (опционально);
+# datetime сериализуется сам, в ISO 8601 — как раньше давал .isoformat()
+from fast_json import fast_json_dumps, fast_json_loads
+
 # Redis подключение
 try:
     redis_client = redis.from_url(
@@ -23,43 +31,126 @@ except Exception as e:
     REDIS_AVAILABLE = False
     logger.warning(f"⚠️ Redis недоступен: {e}")
 
+# Snowflake id задач: миллисекунды << 22 | шард воркера (10 бит) << 12 | счетчик (12 бит).
+# 64 бита вместо 128 у uuid4, без чтения /dev/urandom, и id сортируются по времени создания
+WORKER_SHARD_KEY = "worker_shard_seq"  # Счетчик в Redis: каждый запущенный процесс берет следующий шард
+_worker_shard = None
+_snowflake_lock = threading.Lock()
+_snowflake_last_ms = 0
+_snowflake_seq = 0
+
+def get_worker_shard() -> int:
+    """Шард процесса для id задач: WORKER_SHARD, иначе INCR в Redis, иначе хэш hostname и pid"""
+    global _worker_shard
+    if _worker_shard is None:
+        # Одинаковый шард у двух процессов дает одинаковые id в одну миллисекунду — по умолчанию не 0
+        configured = os.getenv("WORKER_SHARD")
+        if configured:
+            shard = int(configured)
+        else:
+            try:
+                if not REDIS_AVAILABLE:
+                    raise RuntimeError("Redis недоступен")
+                shard = redis_client.incr(WORKER_SHARD_KEY)
+            except Exception as e:
+                logger.warning(f"⚠️ Шард воркера из хэша hostname/pid (Redis: {e}); лучше задать WORKER_SHARD")
+                shard = int.from_bytes(hashlib.blake2b(f"{socket.gethostname()}:{os.getpid()}".encode(), digest_size=2).digest(), 'little')
+        _worker_shard = shard & 0x3FF
+    return _worker_shard
+
+def _reset_worker_shard():
+    """Дочерний процесс после fork получает свой шард"""
+    global _worker_shard
+    _worker_shard = None
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_worker_shard)
+
+def next_task_id() -> str:
+    """Монотонный 64-битный id задачи в hex"""
+    global _snowflake_last_ms, _snowflake_seq
+    with _snowflake_lock:
+        worker_shard = get_worker_shard()
+        now_ms = max(time.time_ns() // 1_000_000, _snowflake_last_ms)
+        if now_ms == _snowflake_last_ms:
+            _snowflake_seq = (_snowflake_seq + 1) & 0xFFF
+            if _snowflake_seq == 0:
+                # 4096 id за миллисекунду исчерпаны — занимаем следующую
+                now_ms += 1
+        else:
+            _snowflake_seq = 0
+        _snowflake_last_ms = now_ms
+        return format((now_ms << 22) | (worker_shard << 12) | _snowflake_seq, 'x')
+
+UPLOAD_INDEX_KEY = "upload_index"  # video_id -> имя файла в UPLOAD_DIR (пишет обработчик загрузки)
+STALE_TASK_TIMEOUT = 3600  # Задача в processing дольше часа с момента взятия считается потерянной (воркер упал)
+
 class TaskQueue:
     """Простая очередь задач на Redis"""
     
     def __init__(self):
         self.queue_name = "video_processing_queue"
-        self.processing_set = "processing_tasks"
+        # Надежная очередь: BLMOVE атомарно переносит задачу в список обрабатываемых,
+        # он же журнал для восстановления задач упавших воркеров
+        self.processing_list = "processing_tasks:list"
+        # task_id -> время взятия воркером (time.time()): зависание считается от него, а не от постановки в очередь
+        self.claims_key = "processing_tasks:claimed"
         self.results_prefix = "task_result:"
+        self.in_flight = {}  # task_id -> сырая запись задачи (для LREM при завершении)
         
     def add_task(self, task_data: Dict) -> str:
         """Добавить задачу в очередь"""
         if not REDIS_AVAILABLE:
             return None
             
-        task_id = str(uuid.uuid4())
-        task_data["task_id"] = task_id
-        task_data["created_at"] = datetime.now().isoformat()
+        task_id = self._prepare_task(task_data)
         
         try:
-            redis_client.lpush(self.queue_name, json.dumps(task_data))
+            redis_client.lpush(self.queue_name, fast_json_dumps(task_data))
             logger.info(f"📝 Задача добавлена в очередь: {task_id}")
             return task_id
         except Exception as e:
             logger.error(f"❌ Ошибка добавления задачи: {e}")
             return None
     
+    def add_tasks_bulk(self, tasks: List[Dict]) -> List[str]:
+        """Добавить пачку задач за один round-trip (pipeline вместо LPUSH на каждую)"""
+        if not REDIS_AVAILABLE or not tasks:
+            return []
+        
+        task_ids = [self._prepare_task(task_data) for task_data in tasks]
+        
+        try:
+            pipe = redis_client.pipeline(transaction=False)
+            for task_data in tasks:
+                pipe.lpush(self.queue_name, fast_json_dumps(task_data))
+            pipe.execute()
+            logger.info(f"📝 Добавлено задач в очередь: {len(task_ids)}")
+            return task_ids
+        except Exception as e:
+            logger.error(f"❌ Ошибка пакетного добавления задач: {e}")
+            return []
+    
+    def _prepare_task(self, task_data: Dict) -> str:
+        """Присваивает задаче id и время создания"""
+        task_id = next_task_id()
+        task_data["task_id"] = task_id
+        task_data["created_at"] = datetime.now()
+        return task_id
+    
     def get_task(self) -> Optional[Dict]:
         """Получить задачу из очереди"""
         if not REDIS_AVAILABLE:
             return None
             
         try:
-            # Блокирующее получение задачи (ждем до 5 секунд)
-            result = redis_client.brpop(self.queue_name, timeout=5)
-            if result:
-                task_data = json.loads(result[1])
-                # Помечаем как обрабатываемую
-                redis_client.sadd(self.processing_set, task_data["task_id"])
+            # Блокирующее получение задачи (ждем до 5 секунд): один атомарный round-trip,
+            # задача не теряется между извлечением и пометкой "в обработке"
+            raw = redis_client.blmove(self.queue_name, self.processing_list, timeout=5, src="RIGHT", dest="LEFT")
+            if raw:
+                task_data = fast_json_loads(raw)
+                self.in_flight[task_data["task_id"]] = raw
+                redis_client.hset(self.claims_key, task_data["task_id"], time.time())
                 return task_data
         except Exception as e:
             logger.error(f"❌ Ошибка получения задачи: {e}")
@@ -71,14 +162,18 @@ class TaskQueue:
             return
             
         try:
-            # Сохраняем результат
-            redis_client.setex(
+            # Сохраняем результат и убираем из обрабатываемых одним round-trip
+            pipe = redis_client.pipeline()
+            pipe.setex(
                 f"{self.results_prefix}{task_id}",
                 3600,  # 1 час TTL
-                json.dumps(result)
+                fast_json_dumps(result)
             )
-            # Убираем из обрабатываемых
-            redis_client.srem(self.processing_set, task_id)
+            raw = self.in_flight.pop(task_id, None)
+            if raw is not None:
+                pipe.lrem(self.processing_list, 1, raw)
+            pipe.hdel(self.claims_key, task_id)
+            pipe.execute()
             logger.info(f"✅ Задача завершена: {task_id}")
         except Exception as e:
             logger.error(f"❌ Ошибка завершения задачи: {e}")
@@ -91,7 +186,7 @@ class TaskQueue:
         try:
             result = redis_client.get(f"{self.results_prefix}{task_id}")
             if result:
-                return json.loads(result)
+                return fast_json_loads(result)
         except Exception as e:
             logger.error(f"❌ Ошибка получения результата: {e}")
         return None
@@ -104,42 +199,162 @@ class TaskQueue:
         try:
             return {
                 "queue_length": redis_client.llen(self.queue_name),
-                "processing": redis_client.scard(self.processing_set),
+                "processing": redis_client.llen(self.processing_list),
                 "redis_available": True
             }
         except Exception as e:
             logger.error(f"❌ Ошибка получения статистики: {e}")
             return {"queue_length": 0, "processing": 0, "redis_available": False}
 
+    def update_task_field(self, task_id: str, field: str, value) -> bool:
+        """Записать поле задачи в хэш task:<id> (атомарно и видно всем воркерам)"""
+        if not REDIS_AVAILABLE:
+            return False
+        try:
+            redis_client.hset(f"task:{task_id}", field, fast_json_dumps(value))
+            return True
+        except Exception as e:
+            logger.error(f"❌ Ошибка записи поля задачи: {e}")
+            return False
+    
+    def get_task_fields(self, task_id: str) -> Dict:
+        """Все поля задачи из хэша task:<id>"""
+        if not REDIS_AVAILABLE:
+            return {}
+        try:
+            return {field: fast_json_loads(value) for field, value in redis_client.hgetall(f"task:{task_id}").items()}
+        except Exception as e:
+            logger.error(f"❌ Ошибка чтения полей задачи: {e}")
+            return {}
+    
+    def _requeue_task(self, raw: str, task_id: str) -> bool:
+        """Атомарно переносит запись из processing в голову очереди, если она еще в processing"""
+        def requeue(pipe) -> bool:
+            # WATCH на processing: если задачу за это время завершили или взяли, транзакция повторится
+            if pipe.lpos(self.processing_list, raw) is None:
+                return False
+            pipe.multi()
+            pipe.lrem(self.processing_list, 1, raw)
+            pipe.rpush(self.queue_name, raw)  # RPUSH ставит ее в голову очереди — воркеры забирают справа
+            pipe.hdel(self.claims_key, task_id)
+            return True
+        
+        return redis_client.transaction(requeue, self.processing_list, value_from_callable=True)
+    
+    def requeue_stale_tasks(self) -> int:
+        """Возвращает в очередь задачи, взятые воркером дольше STALE_TASK_TIMEOUT назад"""
+        if not REDIS_AVAILABLE:
+            return 0
+        
+        requeued = 0
+        try:
+            now = time.time()
+            # Время взятия читаем до списка: все записанные отметки относятся к задачам, уже попавшим в processing
+            claims = redis_client.hgetall(self.claims_key)
+            for raw in redis_client.lrange(self.processing_list, 0, -1):
+                task_id = fast_json_loads(raw)["task_id"]
+                claimed_at = claims.get(task_id)
+                if claimed_at is None:
+                    # Воркер упал между BLMOVE и записью отметки — отсчитываем от первого обнаружения
+                    redis_client.hsetnx(self.claims_key, task_id, now)
+                    continue
+                if now - float(claimed_at) < STALE_TASK_TIMEOUT:
+                    continue
+                if self._requeue_task(raw, task_id):
+                    requeued += 1
+            if requeued:
+                logger.warning(f"♻️ Возвращено в очередь зависших задач: {requeued}")
+        except Exception as e:
+            logger.error(f"❌ Ошибка восстановления задач: {e}")
+        return requeued
+
 # Глобальная очередь
 task_queue = TaskQueue()
 
+class LLMCache:
+    """Точный кэш анализа ChatGPT в Redis: ключ — хэш модели, транскрипта и длительности"""
+    
+    def __init__(self, model: str = "gpt-4o", ttl: int = 86400):
+        self.model = model
+        self.ttl = ttl
+        self.prefix = "llm:exact:"
+    
+    def _key(self, transcript_text: str, video_duration: float) -> str:
+        payload = f"{self.model}\n{round(video_duration, 1)}\n{transcript_text}"
+        return self.prefix + hashlib.sha256(payload.encode()).hexdigest()
+    
+    def get(self, transcript_text: str, video_duration: float) -> Optional[Dict]:
+        """Кэшированный анализ или None"""
+        if not REDIS_AVAILABLE:
+            return None
+        try:
+            cached = redis_client.get(self._key(transcript_text, video_duration))
+            if cached:
+                logger.info("⚡ Использован кэшированный анализ ChatGPT")
+                return fast_json_loads(cached)
+        except Exception as e:
+            logger.error(f"❌ Ошибка чтения кэша анализа: {e}")
+        return None
+    
+    def set(self, transcript_text: str, video_duration: float, analysis_result: Dict):
+        """Сохраняет анализ на ttl секунд"""
+        if not REDIS_AVAILABLE:
+            return
+        try:
+            redis_client.setex(self._key(transcript_text, video_duration), self.ttl, fast_json_dumps(analysis_result))
+        except Exception as e:
+            logger.error(f"❌ Ошибка сохранения кэша анализа: {e}")
+
+# Кэш анализа для воркеров: повторы, ретраи и дубликаты загрузок не ходят в OpenAI
+llm_cache = LLMCache()
+
 # Воркер для обработки задач
 class VideoWorker:
     """Воркер для обработки видео задач"""
     
-    def __init__(self, worker_id: str):
+    def __init__(self, worker_id: str, concurrency: int = 1):
         self.worker_id = worker_id
+        self.concurrency = concurrency
         self.running = False
+        self.active_tasks = set()  # Ссылки на запущенные задачи, чтобы их не собрал GC
     
     async def start(self):
-        """Запуск воркера"""
+        """Запуск воркера: один цикл забирает задачи и выполняет до concurrency одновременно"""
         self.running = True
-        logger.info(f"🔄 Воркер {self.worker_id} запущен")
+        semaphore = asyncio.Semaphore(self.concurrency)
+        logger.info(f"🔄 Воркер {self.worker_id} запущен, параллельно до {self.concurrency} задач")
         
         while self.running:
+            # Слот берем до извлечения: задача не уходит из очереди, пока ее некому выполнять
+            await semaphore.acquire()
             try:
-                # Получаем задачу из очереди
-                task = task_queue.get_task()
-                if task:
-                    await self.process_task(task)
-                else:
-                    # Если задач нет, ждем немного
-                    await asyncio.sleep(1)
-                    
+                # Получаем задачу из очереди (BLMOVE ждет до 5 секунд — в потоке, не блокируя выполняемые задачи)
+                task = await asyncio.to_thread(task_queue.get_task)
             except Exception as e:
+                semaphore.release()
                 logger.error(f"❌ Ошибка воркера {self.worker_id}: {e}")
                 await asyncio.sleep(5)
+                continue
+            
+            if task:
+                running_task = asyncio.create_task(self._run_task(task, semaphore))
+                self.active_tasks.add(running_task)
+                running_task.add_done_callback(self.active_tasks.discard)
+            else:
+                semaphore.release()
+                if not REDIS_AVAILABLE:
+                    # Без Redis get_task возвращается сразу — ждем, чтобы не крутить пустой цикл.
+                    # С Redis ожидание уже внутри BLMOVE: задача подхватывается сразу по приходу
+                    await asyncio.sleep(1)
+    
+    async def _run_task(self, task: Dict, semaphore: asyncio.Semaphore):
+        """Выполняет задачу и освобождает слот"""
+        try:
+            await self.process_task(task)
+        except Exception as e:
+            logger.error(f"❌ Ошибка воркера {self.worker_id}: {e}")
+        finally:
+            semaphore.release()
     
     async def process_task(self, task: Dict):
         """Обработка одной задачи"""
@@ -157,7 +372,7 @@ class VideoWorker:
                 "status": "completed",
                 "result": result,
                 "worker_id": self.worker_id,
-                "completed_at": datetime.now().isoformat()
+                "completed_at": datetime.now()
             })
             
         except Exception as e:
@@ -166,7 +381,7 @@ class VideoWorker:
                 "status": "failed",
                 "error": str(e),
                 "worker_id": self.worker_id,
-                "failed_at": datetime.now().isoformat()
+                "failed_at": datetime.now()
             })
     
     async def analyze_video_internal(self, video_id: str) -> Dict:
@@ -174,34 +389,42 @@ class VideoWorker:
         # Здесь копируем логику из analyze_video_task
         # но делаем её более легковесной
         
-        # Находим видео файл
-        video_files = [f for f in os.listdir(Config.UPLOAD_DIR) if f.startswith(video_id)]
-        if not video_files:
-            raise Exception("Видео файл не найден")
-        
-        video_path = os.path.join(Config.UPLOAD_DIR, video_files[0])
+        # Находим видео файл: индекс загрузок в Redis (HGET), glob — только для файлов вне индекса
+        filename = await asyncio.to_thread(redis_client.hget, UPLOAD_INDEX_KEY, video_id) if REDIS_AVAILABLE else None
+        if filename:
+            video_path = os.path.join(Config.UPLOAD_DIR, filename)
+        else:
+            video_files = glob.glob(os.path.join(Config.UPLOAD_DIR, f"{video_id}*"))
+            if not video_files:
+                raise Exception("Видео файл не найден")
+            video_path = video_files[0]
         
         # Извлечение аудио (оптимизированное)
+        # Блокирующие ffmpeg/Whisper/ChatGPT вызовы — в потоках: воркеры работают на одном event loop,
+        # и так транскрипции разных задач идут одновременно, а не по очереди
         audio_path = os.path.join(Config.AUDIO_DIR, f"{video_id}.wav")
-        if not extract_audio(video_path, audio_path):
+        if not await asyncio.to_thread(extract_audio, video_path, audio_path):
             raise Exception("Ошибка извлечения аудио")
         
         # Получаем длительность видео для транскрипции
-        video_duration = get_video_duration(video_path)
+        video_duration = await asyncio.to_thread(get_video_duration, video_path)
         
         # Транскрипция (без эмоджи в quick_scaling_solution.py по умолчанию)
-        transcript_result = safe_transcribe_audio(audio_path, False, video_duration)
+        transcript_result = await asyncio.to_thread(safe_transcribe_audio, audio_path, False, video_duration)
         if not transcript_result:
             raise Exception("Ошибка транскрипции")
         
-        if "words" in transcript_result:
-            transcript_text = " ".join([word["word"] for word in transcript_result["words"]])
-            transcript_words = transcript_result["words"]
+        transcript_words = transcript_result.get("words") or []
+        if transcript_words:
+            transcript_text = " ".join(word["word"] for word in transcript_words)
         else:
             transcript_text = transcript_result.get("text", "")
-            transcript_words = []
         
-        analysis_result = analyze_with_chatgpt(transcript_text, video_duration)
+        analysis_result = await asyncio.to_thread(llm_cache.get, transcript_text, video_duration)
+        if analysis_result is None:
+            analysis_result = await asyncio.to_thread(analyze_with_chatgpt, transcript_text, video_duration)
+            if analysis_result:
+                await asyncio.to_thread(llm_cache.set, transcript_text, video_duration, analysis_result)
         if not analysis_result:
             analysis_result = create_fallback_highlights(video_duration, 3)
         
@@ -226,16 +449,19 @@ class VideoWorker:
 workers = []
 
 async def start_workers(num_workers: int = 3):
-    """Запуск нескольких воркеров"""
+    """Запуск воркера на num_workers параллельных задач"""
     global workers
     
-    for i in range(num_workers):
-        worker = VideoWorker(f"worker_{i+1}")
-        workers.append(worker)
-        # Запускаем в фоне
-        asyncio.create_task(worker.start())
+    # Задачи воркеров, упавших посреди обработки, снова попадают в очередь
+    task_queue.requeue_stale_tasks()
+    
+    # Один цикл опроса Redis вместо num_workers: параллельность задает семафор воркера
+    worker = VideoWorker(os.getenv("WORKER_ID", "worker-1"), concurrency=num_workers)
+    workers.append(worker)
+    # Запускаем в фоне
+    asyncio.create_task(worker.start())
     
-    logger.info(f"🚀 Запущено {num_workers} воркеров")
+    logger.info(f"🚀 Запущен воркер на {num_workers} параллельных задач")
 
 def stop_all_workers():
     """Остановка всех воркеров"""
@@ -3,9 +3,13 @@
 
 import re
 import logging
+import itertools
 
 logger = logging.getLogger(__name__)
 
+# Знаки конца фразы, по которым разбиваются субтитры
+_CAPTION_PUNCTUATION = frozenset('.,!?')
+
 def getCaptionsWithTime(transcriptions, maxCaptionSize=15, considerPunctuation=True):
     """
     Создает субтитры с таймингами на основе транскрипции
@@ -14,19 +18,19 @@ def getCaptionsWithTime(transcriptions, maxCaptionSize=15, considerPunctuation=T
     time_splits = []
     current_caption = []
     current_length = 0
+    caption_start_idx = 0  # Индекс первого слова текущего субтитра в all_words
     
-    # Работаем только с сегментами которые имеют word-level тайминги
-    segments = [seg for seg in transcriptions.get('segments', []) if 'words' in seg]
-    
-    # Собираем все слова из всех сегментов
-    all_words = []
-    for segment in segments:
-        all_words.extend(segment['words'])
+    # Собираем непустые слова всех сегментов с word-level таймингами за один проход:
+    # без пустых слов all_words[i - 1] — всегда предыдущее слово, а последнее слово всегда закрывает субтитр
+    all_words = [
+        word for word in itertools.chain.from_iterable(
+            seg['words'] for seg in transcriptions.get('segments') or () if 'words' in seg
+        )
+        if word.get('text', '').strip()
+    ]
     
     for i, word in enumerate(all_words):
-        word_text = word.get('text', '').strip()
-        if not word_text:
-            continue
+        word_text = word['text'].strip()
         
         # Проверяем превысит ли это слово maxCaptionSize
         new_length = current_length + len(word_text) + (1 if current_caption else 0)
@@ -34,30 +38,34 @@ def getCaptionsWithTime(transcriptions, maxCaptionSize=15, considerPunctuation=T
         # Определяем нужно ли разделить здесь
         should_split = (
             new_length > maxCaptionSize or
-            (considerPunctuation and word_text.rstrip('.,!?') != word_text and current_caption) or
+            (considerPunctuation and word_text[-1] in _CAPTION_PUNCTUATION and current_caption) or
             i == len(all_words) - 1 or
             len(current_caption) >= 5
         )
         
         # Добавляем слово к текущему субтитру если еще не разделяем
         if not should_split:
+            if not current_caption:
+                caption_start_idx = i
             current_caption.append(word_text)
             current_length = new_length
             continue
             
-        # Обрабатываем разделение
+        # Обрабатываем разделение; флаг вместо поиска слова в списке (O(1) вместо O(k))
+        appended_last = False
         if current_caption:
             # Добавляем текущее слово если это последнее
             if i == len(all_words) - 1 and new_length <= maxCaptionSize:
                 current_caption.append(word_text)
+                appended_last = True
                 
             caption_text = ' '.join(current_caption)
-            start_time = all_words[i - len(current_caption)]['start']
-            end_time = word['end'] if word_text in current_caption else all_words[i - 1]['end']
+            start_time = all_words[caption_start_idx]['start']
+            end_time = word['end'] if appended_last else all_words[i - 1]['end']
             time_splits.append(((start_time, end_time), caption_text))
             
         # Обрабатываем текущее слово если оно не было добавлено к предыдущему субтитру
-        if word_text not in current_caption and i == len(all_words) - 1:
+        if not appended_last and i == len(all_words) - 1:
             time_splits.append(((word['start'], word['end']), word_text))
             
         # Сбрасываем для следующего субтитра
@@ -66,11 +74,61 @@ def getCaptionsWithTime(transcriptions, maxCaptionSize=15, considerPunctuation=T
         
         # Начинаем новый субтитр с текущим словом если это не последнее
         if i < len(all_words) - 1:
+            caption_start_idx = i
             current_caption.append(word_text)
             current_length = len(word_text)
     
     return time_splits
 
+# Определяем стили субтитров - Montserrat Bold, тонкая обводка
+SUBTITLE_STYLES = {
+    'modern': {
+        'fontsize': 48,
+        'fontcolor': 'white',
+        'bordercolor': 'black',
+        'borderw': 1,  # Уменьшил обводку
+        'fontfile': '/usr/share/fonts/truetype/dejavu/DejaVu-Sans-Bold.ttf',  # Жирный шрифт
+        'highlight_color': '#4A90E2'  # Синий хайлайт
+    },
+    'neon': {
+        'fontsize': 48,
+        'fontcolor': 'white',
+        'bordercolor': 'black',
+        'borderw': 1,
+        'fontfile': '/usr/share/fonts/truetype/dejavu/DejaVu-Sans-Bold.ttf',
+        'highlight_color': '#00FFFF'  # Бирюзовый хайлайт
+    },
+    'fire': {
+        'fontsize': 48,
+        'fontcolor': 'white',
+        'bordercolor': 'black',
+        'borderw': 1,
+        'fontfile': '/usr/share/fonts/truetype/dejavu/DejaVu-Sans-Bold.ttf',
+        'highlight_color': '#FF6B35'  # Оранжевый хайлайт
+    },
+    'elegant': {
+        'fontsize': 48,
+        'fontcolor': 'white',
+        'bordercolor': 'black',
+        'borderw': 1,
+        'fontfile': '/usr/share/fonts/truetype/dejavu/DejaVu-Sans-Bold.ttf',
+        'highlight_color': '#C0C0C0'  # Серебристый хайлайт
+    }
+}
+
+# Шаблоны drawtext для каждого стиля; {text}, {start}, {end} подставляются на сегмент
+SUBTITLE_DRAWTEXT_TEMPLATES = {
+    name: (
+        f"drawtext=text={{text}}:fontfile={params['fontfile']}:fontsize={params['fontsize']}"
+        f":fontcolor={params['fontcolor']}:bordercolor={params['bordercolor']}:borderw={params['borderw']}"
+        f":x=(w-text_w)/2:y=h-text_h-60:enable=between(t\\,{{start}}\\,{{end}})"
+    )
+    for name, params in SUBTITLE_STYLES.items()
+}
+
+# Все, кроме букв, цифр и пробелов (такой текст не требует экранирования для FFmpeg)
+_NON_WORD_RE = re.compile(r"[^\w\s]")
+
 def create_simple_subtitle_filter(segments, style='modern'):
     """
     Создает простой FFmpeg фильтр для субтитров на основе подхода ShortGPT
@@ -82,50 +140,8 @@ def create_simple_subtitle_filter(segments, style='modern'):
     
     logger.info(f"📝 Создаем простые субтитры для {len(segments)} сегментов, стиль: {style}")
     
-    # Определяем стили субтитров - Montserrat Bold, тонкая обводка
-    styles = {
-        'modern': {
-            'fontsize': 48,
-            'fontcolor': 'white',
-            'bordercolor': 'black',
-            'borderw': 1,  # Уменьшил обводку
-            'fontfile': '/usr/share/fonts/truetype/dejavu/DejaVu-Sans-Bold.ttf',  # Жирный шрифт
-            'highlight_color': '#4A90E2'  # Синий хайлайт
-        },
-        'neon': {
-            'fontsize': 48,
-            'fontcolor': 'white',
-            'bordercolor': 'black',
-            'borderw': 1,
-            'fontfile': '/usr/share/fonts/truetype/dejavu/DejaVu-Sans-Bold.ttf',
-            'highlight_color': '#00FFFF'  # Бирюзовый хайлайт
-        },
-        'fire': {
-            'fontsize': 48,
-            'fontcolor': 'white',
-            'bordercolor': 'black',
-            'borderw': 1,
-            'fontfile': '/usr/share/fonts/truetype/dejavu/DejaVu-Sans-Bold.ttf',
-            'highlight_color': '#FF6B35'  # Оранжевый хайлайт
-        },
-        'elegant': {
-            'fontsize': 48,
-            'fontcolor': 'white',
-            'bordercolor': 'black',
-            'borderw': 1,
-            'fontfile': '/usr/share/fonts/truetype/dejavu/DejaVu-Sans-Bold.ttf',
-            'highlight_color': '#C0C0C0'  # Серебристый хайлайт
-        }
-    }
-    
-    # Получаем параметры стиля (с жирным шрифтом)
-    style_params = styles.get(style.lower(), styles['modern'])
-    fontsize = style_params['fontsize']
-    fontcolor = style_params['fontcolor']
-    bordercolor = style_params['bordercolor']
-    borderw = style_params['borderw']
-    fontfile = style_params['fontfile']
-    highlight_color = style_params['highlight_color']
+    # Шаблон drawtext для стиля собран заранее, на сегмент остается только format()
+    drawtext_template = SUBTITLE_DRAWTEXT_TEMPLATES.get(style.lower(), SUBTITLE_DRAWTEXT_TEMPLATES['modern'])
     
     # Создаем простые drawtext фильтры
     drawtext_filters = []
@@ -139,7 +155,7 @@ def create_simple_subtitle_filter(segments, style='modern'):
             continue
         
         # Очищаем текст более агрессивно для FFmpeg
-        text = re.sub(r"[^\w\s]", "", text)  # Только буквы, цифры и пробелы
+        text = _NON_WORD_RE.sub("", text)  # Только буквы, цифры и пробелы
         text = text.strip()
         
         # Ограничиваем длину
@@ -150,7 +166,7 @@ def create_simple_subtitle_filter(segments, style='modern'):
             continue
         
         # Создаем простой drawtext фильтр с жирным шрифтом
-        drawtext = f"drawtext=text={text}:fontfile={fontfile}:fontsize={fontsize}:fontcolor={fontcolor}:bordercolor={bordercolor}:borderw={borderw}:x=(w-text_w)/2:y=h-text_h-60:enable=between(t\\,{start_time}\\,{end_time})"
+        drawtext = drawtext_template.format(text=text, start=start_time, end=end_time)
         
         drawtext_filters.append(drawtext)
         logger.info(f"📝 Субтитр {i+1}: '{text}' ({start_time:.1f}s - {end_time:.1f}s)")
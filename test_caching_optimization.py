@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Тесты файлового кэша транскриптов и анализа (caching_optimization)
+"""
+import pytest
+
+@pytest.fixture
+def cache_module(tmp_path, monkeypatch):
+    """Модуль импортируется во временной папке: глобальный кэш создает папку cache при импорте"""
+    monkeypatch.chdir(tmp_path)
+    import caching_optimization
+    return caching_optimization
+
+@pytest.fixture
+def cache(cache_module):
+    """Отдельный экземпляр кэша в tmp_path/cache"""
+    return cache_module.VideoAnalysisCache()
+
+def test_video_hash_is_stable_and_content_sensitive(cache, tmp_path):
+    """Одинаковые файлы — одинаковый хэш, другое содержимое — другой"""
+    first = tmp_path / "a.mp4"
+    second = tmp_path / "b.mp4"
+    third = tmp_path / "c.mp4"
+    first.write_bytes(b"video" * 1000)
+    second.write_bytes(b"video" * 1000)
+    third.write_bytes(b"VIDEO" * 1000)
+    assert cache.get_video_hash(str(first)) == cache.get_video_hash(str(second))
+    assert cache.get_video_hash(str(first)) != cache.get_video_hash(str(third))
+    assert len(cache.get_video_hash(str(first))) == 16  # BLAKE2b с digest_size=8
+    assert cache.get_video_hash(str(tmp_path / "missing.mp4")) is None
+
+def test_cached_results_are_independent_copies(cache, tmp_path):
+    """Изменение возвращенного результата не портит кэш в памяти"""
+    video = tmp_path / "v.mp4"
+    video.write_bytes(b"data" * 100)
+    cache.cache_transcript(str(video), {"text": "привет", "words": [{"word": "привет"}]})
+
+    first = cache.get_cached_transcript(str(video))
+    first["words"].append({"word": "лишнее"})
+    first["text"] = "изменено"
+    assert cache.get_cached_transcript(str(video)) == {"text": "привет", "words": [{"word": "привет"}]}
+
+    cache.cache_analysis("текст", 60.0, {"highlights": [1]})
+    cache.get_cached_analysis("текст", 60.0)["highlights"].clear()
+    assert cache.get_cached_analysis("текст", 60.0) == {"highlights": [1]}
+
+def test_cache_entries_expire_after_24h_and_12h(cache_module, cache, tmp_path, monkeypatch):
+    """Транскрипт живет 24 часа, анализ — 12 часов: и в памяти, и на диске"""
+    video = tmp_path / "v.mp4"
+    video.write_bytes(b"data" * 100)
+    cache.cache_transcript(str(video), {"text": "t"})
+    cache.cache_analysis("текст", 60.0, {"highlights": []})
+    now = cache_module.time.time()
+
+    def advance(seconds):
+        monkeypatch.setattr(cache_module.time, "time", lambda: now + seconds)
+
+    for check_cache in (cache, cache_module.VideoAnalysisCache()):  # Память и чтение с диска
+        advance(12 * 3600 - 60)
+        assert check_cache.get_cached_analysis("текст", 60.0) == {"highlights": []}
+        advance(12 * 3600 + 60)
+        assert check_cache.get_cached_analysis("текст", 60.0) is None
+        assert check_cache.get_cached_transcript(str(video)) == {"text": "t"}
+        advance(24 * 3600 + 60)
+        assert check_cache.get_cached_transcript(str(video)) is None
+
+def test_video_hash_memo_invalidated_by_mtime_and_size(cache, tmp_path):
+    """Хэш берется из памяти, пока не изменились mtime или размер файла"""
+    import os
+
+    video = tmp_path / "v.mp4"
+    video.write_bytes(b"a" * 1000)
+    original = cache.get_video_hash(str(video))
+
+    # Тот же размер и mtime — повторного чтения нет, даже если содержимое подменено
+    stat_result = os.stat(video)
+    video.write_bytes(b"b" * 1000)
+    os.utime(video, ns=(stat_result.st_atime_ns, stat_result.st_mtime_ns))
+    assert cache.get_video_hash(str(video)) == original
+
+    # Изменился mtime — хэш пересчитывается
+    os.utime(video, ns=(stat_result.st_atime_ns, stat_result.st_mtime_ns + 1_000_000_000))
+    changed = cache.get_video_hash(str(video))
+    assert changed != original
+
+    # Изменился размер при том же mtime — тоже пересчет
+    video.write_bytes(b"b" * 1001)
+    os.utime(video, ns=(stat_result.st_atime_ns, stat_result.st_mtime_ns + 1_000_000_000))
+    assert cache.get_video_hash(str(video)) not in (original, changed)
+
+def test_video_hash_fingerprint_head_and_tail(cache_module, tmp_path):
+    """Отпечаток — размер, первые и последние 64KB; у файлов меньше 64KB оба куска — весь файл"""
+    import hashlib
+
+    def expected_hash(data):
+        digest = hashlib.blake2b(digest_size=8)
+        digest.update(len(data).to_bytes(8, 'little'))
+        digest.update(data[:cache_module.HASH_SAMPLE_SIZE])
+        digest.update(data[-cache_module.HASH_SAMPLE_SIZE:])
+        return digest.hexdigest()
+
+    small = tmp_path / "small.mp4"
+    small.write_bytes(b"tiny video")
+    assert cache_module.VideoAnalysisCache().get_video_hash(str(small)) == expected_hash(b"tiny video")
+    empty = tmp_path / "empty.mp4"
+    empty.write_bytes(b"")
+    assert cache_module.VideoAnalysisCache().get_video_hash(str(empty)) == expected_hash(b"")
+
+    # Большой файл: середина в хэш не входит, хвост — входит
+    sample = cache_module.HASH_SAMPLE_SIZE
+    data = bytearray(b"h" * sample + b"m" * sample + b"t" * sample)
+    big = tmp_path / "big.mp4"
+    big.write_bytes(data)
+    base = cache_module.VideoAnalysisCache().get_video_hash(str(big))
+    assert base == expected_hash(bytes(data))
+
+    data[sample + 10] = ord("X")
+    big.write_bytes(data)
+    assert cache_module.VideoAnalysisCache().get_video_hash(str(big)) == base
+    data[-1] = ord("X")
+    big.write_bytes(data)
+    assert cache_module.VideoAnalysisCache().get_video_hash(str(big)) != base
+
+def test_cache_files_are_sharded_by_hash_prefix(cache, tmp_path):
+    """Файлы кэша лежат в подкаталоге по первым двум символам хэша"""
+    import os
+
+    video = tmp_path / "v.mp4"
+    video.write_bytes(b"data" * 100)
+    video_hash = cache.get_video_hash(str(video))
+    cache.cache_transcript(str(video), {"text": "t"}, auto_emoji=True)
+    assert os.path.isfile(os.path.join("cache", video_hash[:2], f"transcript_{video_hash}_True.json"))
+    assert cache._cache_path("abcdef", "x.json") == os.path.join("cache", "ab", "x.json")
+
+def test_cleanup_removes_old_sharded_and_flat_files(cache, tmp_path):
+    """Очистка удаляет файлы старше 48 часов и в шардах, и в старой плоской раскладке"""
+    import os
+    import time
+
+    old_time = time.time() - 49 * 3600
+    paths = {
+        "old_sharded": tmp_path / "cache" / "ab" / "analysis_ab.json",
+        "new_sharded": tmp_path / "cache" / "cd" / "analysis_cd.json",
+        "old_flat": tmp_path / "cache" / "transcript_old.json",
+        "new_flat": tmp_path / "cache" / "transcript_new.json",
+    }
+    for name, path in paths.items():
+        path.parent.mkdir(exist_ok=True)
+        path.write_bytes(b"{}")
+        if name.startswith("old"):
+            os.utime(path, (old_time, old_time))
+    # Удаленный файл вытесняется и из памяти
+    cache._memory_put(os.path.join("cache", "ab", "analysis_ab.json"), b"{}", time.time())
+
+    cache.cleanup_old_cache()
+    assert {name for name, path in paths.items() if path.exists()} == {"new_sharded", "new_flat"}
+    assert cache._memory_cache == {}
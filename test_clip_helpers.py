@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Тесты вспомогательных функций нарезки клипов из app.py
+"""
+import os
+import random
+import sys
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("psutil")
+pytest.importorskip("openai")
+
+@pytest.fixture(scope="module")
+def app_module(tmp_path_factory):
+    """Импортирует app.py во временной папке (папки uploads/audio/clips создаются при импорте)"""
+    os.environ.setdefault("OPENAI_API_KEY", "test-key")
+    cwd = os.getcwd()
+    sys.path.insert(0, cwd)
+    os.chdir(tmp_path_factory.mktemp("app"))
+    try:
+        import app
+    finally:
+        os.chdir(cwd)
+    return app
+
+def linear_clip_words(transcript, start_time, end_time):
+    """Прежний линейный отбор слов клипа (до индекса с бинарным поиском)"""
+    return [
+        {**word, "start": word.get("start", 0) - start_time, "end": word.get("end", 0) - start_time}
+        for word in transcript
+        if word.get("start", 0) < end_time and word.get("end", 0) > start_time
+    ]
+
+def indexed_clip_words(app_module, transcript, start_time, end_time, monkeypatch):
+    """Слова, которые prepare_clip_subtitles передает в группировку"""
+    captured = {}
+
+    def capture(words, words_per_group=6):
+        captured["words"] = words
+        return []
+
+    monkeypatch.setattr(app_module, "group_words_into_subtitles", capture)
+    app_module.prepare_clip_subtitles(
+        transcript, start_time, end_time,
+        transcript_index=app_module.build_transcript_index(transcript)
+    )
+    return captured["words"]
+
+def test_prepare_clip_subtitles_matches_linear_selection(app_module, monkeypatch):
+    """Бинарный поиск отбирает те же слова в том же порядке, что и линейный проход"""
+    rng = random.Random(42)
+    transcript = []
+    for k in range(300):
+        start = round(rng.uniform(0, 120), 2)
+        # Длинные слова перекрывают соседей — проверяет префиксный максимум end
+        duration = round(rng.choice([0.2, 0.5, 1.0, 8.0]), 2)
+        transcript.append({"word": f"w{k}", "start": start, "end": start + duration})
+    transcript.append({"word": "no_times"})
+
+    ranges = [(0, 10), (5.5, 42.0), (60, 60.5), (110, 200), (-5, 0), (119.9, 130)]
+    for start_time, end_time in ranges:
+        # Неупорядоченный вход и тот же вход, отсортированный по start
+        for words in (transcript, sorted(transcript, key=lambda w: w.get("start", 0))):
+            expected = linear_clip_words(words, start_time, end_time)
+            assert indexed_clip_words(app_module, words, start_time, end_time, monkeypatch) == expected
+
+def test_prepare_clip_subtitles_overlapping_long_word(app_module, monkeypatch):
+    """Слово, начавшееся задолго до клипа и перекрывающее его, попадает в субтитры"""
+    transcript = [
+        {"word": "long", "start": 0.0, "end": 30.0},
+        {"word": "a", "start": 1.0, "end": 1.5},
+        {"word": "b", "start": 21.0, "end": 21.5},
+        {"word": "after", "start": 25.0, "end": 26.0},
+    ]
+    words = indexed_clip_words(app_module, transcript, 20.0, 25.0, monkeypatch)
+    assert [w["word"] for w in words] == ["long", "b"]
+    assert words[0]["start"] == -20.0 and words[0]["end"] == 10.0
+
+def test_clips_status_bulk(app_module, tmp_path, monkeypatch):
+    """Bulk-статус: готовые клипы с размером, отсутствующие и пути вне CLIPS_DIR — ready: False"""
+    from fastapi.testclient import TestClient
+
+    clips_dir = tmp_path / "clips"
+    clips_dir.mkdir()
+    (clips_dir / "vid_clip_1.mp4").write_bytes(b"x" * 123)
+    (clips_dir / "vid_clip_2.mp4").mkdir()  # Не файл
+    (tmp_path / "secret.mp4").write_bytes(b"y")
+    monkeypatch.setattr(app_module.Config, "CLIPS_DIR", str(clips_dir))
+
+    response = TestClient(app_module.app).post(
+        "/api/clips/status/bulk",
+        json={"clip_ids": ["vid_clip_1", "vid_clip_2", "vid_clip_3", "../secret"]}
+    )
+    assert response.status_code == 200
+    assert response.json() == {"clips": {
+        "vid_clip_1": {"ready": True, "size": 123, "download_url": "/api/videos/download/vid_clip_1.mp4"},
+        "vid_clip_2": {"ready": False},
+        "vid_clip_3": {"ready": False},
+        "../secret": {"ready": False},
+    }}
+
+def test_snap_to_keyframes(app_module):
+    """Границы расширяются до ближайших ключевых кадров снаружи диапазона"""
+    snap = app_module.snap_to_keyframes
+    keyframes = [2.0, 4.0, 6.0, 8.0]
+    # Нет ключевых кадров — границы не меняются
+    assert snap([], 3.0, 5.0) == (3.0, 5.0)
+    # Точное совпадение с ключевыми кадрами
+    assert snap(keyframes, 4.0, 6.0) == (4.0, 6.0)
+    # Внутри между кадрами — наружу до соседних
+    assert snap(keyframes, 4.5, 5.5) == (4.0, 6.0)
+    # Начало раньше первого кадра и конец позже последнего — остаются как есть
+    assert snap(keyframes, 1.0, 3.0) == (1.0, 4.0)
+    assert snap(keyframes, 7.0, 9.5) == (6.0, 9.5)
+
+def test_stream_copy_clip_reports_snapped_bounds(app_module, tmp_path, monkeypatch):
+    """Stream copy: длительность клипа и сдвиг SRT считаются по границам на ключевых кадрах"""
+    import asyncio
+    import subprocess
+
+    monkeypatch.setattr(app_module.Config, "CLIPS_DIR", str(tmp_path))
+    monkeypatch.setattr(app_module, "get_keyframe_times", lambda path: [0.0, 8.0, 20.0, 33.0])
+    monkeypatch.setattr(app_module, "upload_clip_to_supabase", lambda path, name: f"/local/{name}")
+    monkeypatch.setattr(app_module, "prepare_clip_subtitles", lambda **kwargs: [{
+        "start": 0.5, "end": 1.5, "text": "HELLO",
+        "words": [{"word": "HELLO", "start": 0.5, "end": 1.5}]
+    }])
+    calls = []
+
+    def fake_run(cmd, **kwargs):
+        srt_path = cmd[cmd.index("-i", cmd.index("-i") + 1) + 1]
+        with open(srt_path, encoding="utf-8") as f:
+            calls.append((cmd, f.read()))
+        return subprocess.CompletedProcess(cmd, 0, b"", b"")
+
+    monkeypatch.setattr(app_module.subprocess, "run", fake_run)
+    highlights = [{"start_time": 10.0, "end_time": 30.0, "title": "t"}]
+    clips = asyncio.run(app_module.cut_video_into_clips("in.mp4", highlights, [], "vid", "9x16", stream_copy=True))
+
+    cmd, srt = calls[0]
+    assert cmd[cmd.index("-ss") + 1] == "8.0" and cmd[cmd.index("-t") + 1] == "25.0"
+    # Субтитр на 0.5s от начала хайлайта — это 2.5s от начала клипа, начатого на 2s раньше
+    assert "00:00:02,500 --> 00:00:03,500" in srt
+    assert clips[0]["duration"] == 25.0
+    assert clips[0]["start_time"] == 10.0  # Данные хайлайта не меняются
+    assert (clips[0]["clip_start_time"], clips[0]["clip_end_time"]) == (8.0, 33.0)
+    # Возвращаемые субтитры совпадают с SRT: отсчет от начала клипа на ключевом кадре
+    subtitle = clips[0]["subtitles"][0]
+    assert (subtitle["start"], subtitle["end"]) == (2.5, 3.5)
+    assert (subtitle["words"][0]["start"], subtitle["words"][0]["end"]) == (2.5, 3.5)
@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+"""
+Тест общего JSON-кодека: одинаковый результат с orjson и без него
+"""
+import importlib
+import sys
+from datetime import datetime
+
+import fast_json
+
+SAMPLE = {"title": "Привет", "score": 8.5, "ids": [1, 2], "created_at": datetime(2024, 1, 2, 3, 4, 5, 6)}
+
+def test_dumps_returns_bytes_with_and_without_orjson(monkeypatch):
+    """dumps всегда возвращает одинаковые bytes, loads принимает и bytes, и str"""
+    encoded = fast_json.fast_json_dumps(SAMPLE)
+    assert isinstance(encoded, bytes)
+
+    # Перезагружаем модуль без orjson — срабатывает запасной путь через json
+    monkeypatch.setitem(sys.modules, "orjson", None)
+    fallback = importlib.reload(fast_json)
+    try:
+        assert not fallback.ORJSON_AVAILABLE
+        fallback_encoded = fallback.fast_json_dumps(SAMPLE)
+        assert isinstance(fallback_encoded, bytes)
+        assert fallback_encoded == encoded
+        assert fallback.fast_json_loads(fallback_encoded) == fallback.fast_json_loads(fallback_encoded.decode("utf-8"))
+        assert fallback.fast_json_loads(fallback_encoded)["created_at"] == "2024-01-02T03:04:05.000006"
+    finally:
+        monkeypatch.undo()
+        importlib.reload(fast_json)
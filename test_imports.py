@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Smoke-тест: каждый модуль сервиса импортируется (ошибки уровня модуля ловятся до деплоя)
+"""
+import importlib
+import os
+import sys
+
+import pytest
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Модули, которые должны импортироваться без OPENAI_API_KEY
+LIBRARY_MODULES = [
+    "fast_json",
+    "shortgpt_captions",
+    "caching_optimization",
+    "quality_control",
+    "optimized_analysis",
+    "prompt_optimization",
+    "quick_scaling_solution",
+]
+
+# Точки входа: требуют OPENAI_API_KEY
+ENTRYPOINT_MODULES = ["app", "worker"]
+
+def import_fresh(name):
+    """Импортирует модуль заново; отсутствующая сторонняя зависимость — пропуск, а не падение"""
+    sys.modules.pop(name, None)
+    if PROJECT_DIR not in sys.path:
+        sys.path.insert(0, PROJECT_DIR)
+    try:
+        return importlib.import_module(name)
+    except ModuleNotFoundError as e:
+        if e.name and os.path.exists(os.path.join(PROJECT_DIR, f"{e.name.split('.')[0]}.py")):
+            raise
+        pytest.skip(f"не установлена зависимость {e.name}")
+
+@pytest.mark.parametrize("name", LIBRARY_MODULES)
+def test_library_module_imports(name, monkeypatch, tmp_path):
+    """Модуль импортируется без ключа OpenAI и внешних сервисов"""
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    monkeypatch.chdir(tmp_path)  # caching_optimization создает папку кэша при импорте
+    assert import_fresh(name) is not None
+
+@pytest.mark.parametrize("name", ENTRYPOINT_MODULES)
+def test_entrypoint_module_imports(name, monkeypatch, tmp_path):
+    """app.py и worker.py импортируются при заданном ключе"""
+    monkeypatch.setenv("OPENAI_API_KEY", os.getenv("OPENAI_API_KEY", "test-key"))
+    monkeypatch.chdir(tmp_path)  # app создает uploads/audio/clips при импорте
+    assert import_fresh(name) is not None
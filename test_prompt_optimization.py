@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Тесты вспомогательных функций промптов (prompt_optimization)
+"""
+import pytest
+
+pytest.importorskip("openai")
+
+import prompt_optimization
+
+def test_smart_content_detection_matches_inflected_forms():
+    """Ключевые слова находятся в формах: learning, explained, apps, stories, jokes"""
+    detect = prompt_optimization.smart_content_detection
+    assert detect("We are learning while he explained the lessons") == 'educational'
+    assert detect("Her jokes and stories were hilarious") == 'entertainment'
+    assert detect("Two apps for programmers") == 'tech'
+    assert detect("Nothing relevant here at all") == 'general'
+
+def test_smart_content_detection_short_keywords_are_not_prefixes():
+    """'ai' и 'app' не совпадают с aim/approach; повтор одного слова считается один раз"""
+    detect = prompt_optimization.smart_content_detection
+    assert detect("We aim for a new approach") == 'general'
+    assert detect("AI and apps, apps, apps. Learn, understand, explain") == 'educational'
+
+class CharEncoding:
+    """Энкодер «один символ — один токен» вместо словаря tiktoken"""
+    def encode(self, text):
+        return [ord(char) for char in text]
+
+    def decode(self, tokens):
+        return "".join(map(chr, tokens))
+
+def test_shorten_transcript_token_budget_depends_on_language(monkeypatch):
+    """Кириллица плотнее по токенам: бюджет для ru больше, чем для en"""
+    monkeypatch.setattr(prompt_optimization, "get_token_encoding", CharEncoding)
+    shorten = prompt_optimization.shorten_transcript
+    text = "x" * 600
+    assert shorten(text, language="ru") == text
+    shortened = shorten(text, language="en")
+    assert shortened != text and len(shortened) <= 375 + 2 * len(" ... ")
+    # Язык по умолчанию — CONTENT_LANGUAGE, неизвестный язык — плотный бюджет
+    monkeypatch.setattr(prompt_optimization, "CONTENT_LANGUAGE", "en")
+    assert shorten(text) == shortened
+    assert shorten(text, language="de") == text
+
+def test_get_target_clips_inclusive_bounds():
+    """До 60s включительно — 1 клип, до 180s — 2, до 600s — 3, дальше — 4"""
+    counts = [prompt_optimization.get_target_clips(d) for d in (0, 60, 60.5, 180, 181, 600, 601, 7200)]
+    assert counts == [1, 1, 2, 2, 3, 3, 4, 4]
@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+"""
+Тесты оценки сложности транскрипта (quality_control.classify_complexity)
+"""
+from quality_control import QualityController, SIMPLE_COMPLEXITY_THRESHOLD
+
+EN_REASONING = ("We compare Python and Rust because Google and Microsoft analyze costs, "
+                "however Amazon disagrees, therefore Netflix and Spotify chose Go although Meta did not. ")
+RU_REASONING = ("Мы сравниваем Python и Rust, потому что Яндекс и Сбер анализируют затраты, "
+                "однако Тинькофф не согласен, поэтому Авито и Озон выбрали Go, хотя ВКонтакте нет. ")
+EN_SIMPLE = "so we went to the park and had fun and then we went home and ate some food "
+RU_SIMPLE = "ну мы пошли в парк и было весело а потом пошли домой и поели чего-то вкусного "
+
+def test_english_and_russian_reasoning_score_alike():
+    """Рассуждения с именами собственными — сложный контент на обоих языках"""
+    controller = QualityController()
+    english = controller.classify_complexity(EN_REASONING * 3)
+    russian = controller.classify_complexity(RU_REASONING * 3)
+    assert english > SIMPLE_COMPLEXITY_THRESHOLD and russian > SIMPLE_COMPLEXITY_THRESHOLD
+    assert abs(english - russian) < 0.15
+
+def test_simple_speech_is_low_complexity_in_both_languages():
+    """Бытовая речь без рассуждений — быстрый путь"""
+    controller = QualityController()
+    assert controller.classify_complexity(EN_SIMPLE * 3) < SIMPLE_COMPLEXITY_THRESHOLD
+    assert controller.classify_complexity(RU_SIMPLE * 3) < SIMPLE_COMPLEXITY_THRESHOLD
+
+def test_russian_stem_markers_match_forms_but_not_lookalikes():
+    """Основы 'анализ'/'сравн' находят формы слов, а 'хотя' не совпадает с 'хотят'"""
+    controller = QualityController()
+    assert controller.classify_complexity("анализируем и сравнении") > controller.classify_complexity("делаем и говорим")
+    assert controller.classify_complexity("они хотят") == controller.classify_complexity("они едят")
+    assert controller.classify_complexity("") == 0.0
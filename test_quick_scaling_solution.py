@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Тесты очереди задач на Redis (quick_scaling_solution) на fakeredis
+"""
+import pytest
+
+pytest.importorskip("redis")
+fakeredis = pytest.importorskip("fakeredis")
+
+import quick_scaling_solution as qs
+
+@pytest.fixture
+def queue(monkeypatch):
+    """Очередь поверх пустого fakeredis"""
+    monkeypatch.setattr(qs, "redis_client", fakeredis.FakeRedis(decode_responses=True))
+    monkeypatch.setattr(qs, "REDIS_AVAILABLE", True)
+    return qs.TaskQueue()
+
+def test_task_moves_through_processing_list(queue):
+    """Взятая задача лежит в processing с отметкой времени, завершение убирает обе записи"""
+    task_id = queue.add_task({"video_id": "v1"})
+    task = queue.get_task()
+    assert task["task_id"] == task_id and task["video_id"] == "v1"
+    assert queue.get_queue_stats() == {"queue_length": 0, "processing": 1, "redis_available": True}
+    assert task_id in qs.redis_client.hgetall(queue.claims_key)
+
+    queue.complete_task(task_id, {"ok": True})
+    assert queue.get_queue_stats()["processing"] == 0
+    assert qs.redis_client.hgetall(queue.claims_key) == {}
+    assert queue.get_task_result(task_id) == {"ok": True}
+
+def test_requeue_uses_claim_time_not_enqueue_time(queue, monkeypatch):
+    """Задача, долго ждавшая в очереди, не считается зависшей сразу после взятия"""
+    clock = [1_000_000.0]
+    monkeypatch.setattr(qs.time, "time", lambda: clock[0])
+
+    task_id = queue.add_task({"video_id": "v1"})
+    clock[0] += 2 * qs.STALE_TASK_TIMEOUT  # Долго ждала в очереди
+    queue.get_task()
+    assert queue.requeue_stale_tasks() == 0
+
+    clock[0] += qs.STALE_TASK_TIMEOUT + 1  # Воркер держит задачу дольше таймаута
+    assert queue.requeue_stale_tasks() == 1
+    assert queue.get_queue_stats()["processing"] == 0
+    assert qs.redis_client.hgetall(queue.claims_key) == {}
+    # Задача вернулась в голову очереди и снова берется первой
+    queue.add_task({"video_id": "v2"})
+    assert queue.get_task()["task_id"] == task_id
+
+def test_requeue_claims_tasks_without_claim_time(queue, monkeypatch):
+    """Задача без отметки (воркер упал сразу после BLMOVE) получает отметку и возвращается позже"""
+    clock = [1_000_000.0]
+    monkeypatch.setattr(qs.time, "time", lambda: clock[0])
+
+    queue.add_task({"video_id": "v1"})
+    task = queue.get_task()
+    qs.redis_client.hdel(queue.claims_key, task["task_id"])
+
+    assert queue.requeue_stale_tasks() == 0
+    assert float(qs.redis_client.hget(queue.claims_key, task["task_id"])) == clock[0]
+    clock[0] += qs.STALE_TASK_TIMEOUT
+    assert queue.requeue_stale_tasks() == 1
+
+def test_requeue_skips_task_completed_meanwhile(queue):
+    """Если задачу уже завершили, запись не возвращается в очередь"""
+    queue.add_task({"video_id": "v1"})
+    task = queue.get_task()
+    raw = queue.in_flight[task["task_id"]]
+    queue.complete_task(task["task_id"], {"ok": True})
+    assert queue._requeue_task(raw, task["task_id"]) is False
+    assert queue.get_queue_stats()["queue_length"] == 0
+
+def test_worker_shard_is_unique_per_process(queue, monkeypatch):
+    """Без WORKER_SHARD каждый процесс берет следующий шард из Redis; явное значение важнее"""
+    monkeypatch.delenv("WORKER_SHARD", raising=False)
+    shards = []
+    for _ in range(2):  # Два процесса: сброс, как после fork
+        qs._reset_worker_shard()
+        shards.append(qs.get_worker_shard())
+    assert shards[0] != shards[1]
+    assert (int(qs.next_task_id(), 16) >> 12) & 0x3FF == shards[1]
+
+    monkeypatch.setenv("WORKER_SHARD", "1027")
+    qs._reset_worker_shard()
+    assert qs.get_worker_shard() == 3  # 10 бит
+
+    # Redis недоступен — шард из хэша hostname/pid, одинаковый в пределах процесса
+    monkeypatch.delenv("WORKER_SHARD")
+    monkeypatch.setattr(qs, "REDIS_AVAILABLE", False)
+    qs._reset_worker_shard()
+    fallback = qs.get_worker_shard()
+    qs._reset_worker_shard()
+    assert qs.get_worker_shard() == fallback and 0 <= fallback < 1024
+    qs._reset_worker_shard()
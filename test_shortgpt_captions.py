@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Тесты разбиения транскрипта на субтитры (getCaptionsWithTime)
+"""
+from shortgpt_captions import getCaptionsWithTime
+
+def make_transcript(texts):
+    """Транскрипт из одного сегмента: слово k звучит с k до k+0.5 секунды"""
+    return {"segments": [{"words": [
+        {"text": text, "start": float(k), "end": k + 0.5} for k, text in enumerate(texts)
+    ]}]}
+
+def test_captions_split_by_length_punctuation_and_last_word():
+    """Последнее слово, которое помещается, дописывается к субтитру; начало — первое слово субтитра"""
+    texts = "hello world this is a test. And more words here ok".split()
+    assert getCaptionsWithTime(make_transcript(texts)) == [
+        ((0.0, 1.5), "hello world"),
+        ((2.0, 4.5), "this is a"),
+        ((5.0, 7.5), "test. And more"),
+        ((8.0, 10.5), "words here ok"),
+    ]
+
+def test_last_word_that_does_not_fit_gets_own_caption():
+    """Последнее слово, которое не помещается, идет отдельным субтитром со своими таймингами"""
+    texts = ["alpha", "beta", "gamma", "extraordinarily"]
+    assert getCaptionsWithTime(make_transcript(texts)) == [
+        ((0.0, 1.5), "alpha beta"),
+        ((2.0, 2.5), "gamma"),
+        ((3.0, 3.5), "extraordinarily"),
+    ]
+
+def test_empty_words_are_skipped():
+    """Пустые слова не сдвигают начало и конец субтитров и не теряют последний субтитр"""
+    texts = ["alpha", "", "beta", "  ", "gamma", "delta", "epsilon", "zeta"]
+    assert getCaptionsWithTime(make_transcript(texts)) == [
+        ((0.0, 2.5), "alpha beta"),
+        ((4.0, 5.5), "gamma delta"),
+        ((6.0, 7.5), "epsilon zeta"),
+    ]
+    # Пустое слово в конце транскрипта
+    assert getCaptionsWithTime(make_transcript(["hi", "there", ""])) == [((0.0, 1.5), "hi there")]
+
+def test_segments_without_word_timings_are_ignored():
+    """Сегменты без 'words' пропускаются, пустой транскрипт — пустой результат"""
+    transcript = make_transcript(["one", "two"])
+    transcript["segments"].insert(0, {"text": "no words"})
+    assert getCaptionsWithTime(transcript) == [((0.0, 1.5), "one two")]
+    assert getCaptionsWithTime({"segments": None}) == []